@@ -1,4 +1,5 @@
 from kombu import Exchange, Queue
+import uuid
 
 AMQP_URL = "amqp://localhost"
 
@@ -23,6 +24,31 @@ QUEUE_SEL_ALERT      = Queue('poller.alert.sel',
                                 EXCHANGE_EVENT,
                                 routing_key='poller.alert.sel.#')
 
+# IPMI poller results and alerts measured by the poller benchmark
+POLLER_QUEUES           = [QUEUE_SEL_RESULT, QUEUE_SDR_RESULT, QUEUE_CHASSIS_RESULT, QUEUE_SEL_ALERT]
+
+def make_poller_queues(queues=POLLER_QUEUES):
+    # exclusive, auto-deleted copies with the same bindings, so the benchmark
+    # does not take results away from other consumers of the named queues
+    run_id = uuid.uuid4()
+    return [Queue('perf.{0}.{1}'.format(queue.name, run_id), queue.exchange, routing_key=queue.routing_key,
+                  exclusive=True, auto_delete=True)
+            for queue in queues]
+
+# Workflow lifecycle events correlated by graph id for the latency breakdown
+LIFECYCLE_BINDINGS      = [(EXCHANGE_EVENT, 'graph.started.*'),
+                           (EXCHANGE_TASK, 'run.#'),
+                           (EXCHANGE_EVENT, 'task.started.*'),
+                           (EXCHANGE_EVENT, 'task.finished.*')]
+
+def make_lifecycle_queues(bindings=LIFECYCLE_BINDINGS):
+    # one exclusive, auto-deleted queue per binding, so copies of RackHD's
+    # events do not pile up in the broker once the harness exits
+    run_id = uuid.uuid4()
+    return [Queue('perf.lifecycle.{0}.{1}'.format(run_id, key), exchange, routing_key=key,
+                  exclusive=True, auto_delete=True)
+            for exchange, key in bindings]
+
 def make_queue_obj(exchange, queue, routing_key, type='topic'):
     return Queue(queue, \
            Exchange(exchange, type=type), \
@@ -10,5 +10,8 @@ LOGLEVELS = {
     'DEBUG': logging.DEBUG
 }
 LOGGER_LVL = "ERROR"
+# Format and write log records on a background thread, at most this many queued
+LOGGER_ASYNC = True
+LOGGER_QUEUE_SIZE = 10000
 logging.basicConfig(level=LOGLEVELS[LOGGER_LVL], format=LOGFORMAT)
 
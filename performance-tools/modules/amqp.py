@@ -7,7 +7,7 @@ from threading import Thread
 from kombu.mixins import ConsumerMixin
 from kombu import BrokerConnection
 from modules.worker import WorkerThread, WorkerTasks
-import signal, sys
+import signal, sys, time
 
 LOG = Log('kombu')
 
@@ -15,9 +15,20 @@ LOG = Log('kombu')
 Class to abstract AMQP consumer event handling
 :param callbacks: optional callbacks to be invoked on queue event
 :param amqp_url: optional AMQP URL to connect, defaults from config/amqp.py
-:param queue: The queue exchange to listen on for events
+:param queue: The queue exchange (or list of queues) to listen on for events
 :param max_retries: Number of connection attempts
 :param max_error: Max number of errored connection recovery attempts
+:param prefetch_count: optional number of unacknowledged messages the broker may deliver, default unlimited
+:param ack_batch: optional number of messages acknowledged together with one multi-ack, default 1
+:param ack_interval: optional max seconds a message waits for its batch ack, default 0.25
+:param backlog_interval: optional seconds between queue depth checks, default 1.0
+:param transport_options: optional kombu transport options, e.g. {'polling_interval': 0.01} for memory://
+:param log_every: optional log only every Nth message with the default on_message callback, default 1
+:param poll_interval: optional max seconds between checks for stop() and due acks while idle, default 0.25
+backlog counts only the messages still ready in the broker, so it shows a
+consumer falling behind only with a bounded prefetch_count.
+Callbacks no longer need to ack: messages a callback leaves unacknowledged
+are acked by the worker once the callbacks return.
 """
 class AMQPWorker(ConsumerMixin):
     def __init__(self, **kwargs):
@@ -26,16 +37,86 @@ class AMQPWorker(ConsumerMixin):
         self.__queue = kwargs.get('queue')
         self.__max_retries = kwargs.get('max_retries',2)
         self.__max_error = kwargs.get('max_error',3)
+        self.__prefetch_count = kwargs.get('prefetch_count')
+        self.__ack_batch = kwargs.get('ack_batch',1)
+        self.__ack_interval = kwargs.get('ack_interval',0.25)
+        self.__backlog_interval = kwargs.get('backlog_interval',1.0)
+        self.__poll_interval = kwargs.get('poll_interval',0.25)
+        self.__log_every = kwargs.get('log_every',1)
         if self.__queue is None:
             raise TypeError('invalid worker queue parameter')
-        self.connection = BrokerConnection(self.__amqp_url)
+        if self.__prefetch_count and self.__ack_batch > self.__prefetch_count:
+            LOG.warning('ack_batch {0} exceeds prefetch_count, using {1}' \
+                .format(self.__ack_batch, self.__prefetch_count))
+            self.__ack_batch = self.__prefetch_count
+        self.__pending = []
+        self.__pending_since = 0
+        self.__channel = None
+        self.__backlog_checked = 0
+        self.consumed = 0
+        self.backlog = None
+        self.connection = BrokerConnection(self.__amqp_url, transport_options=kwargs.get('transport_options'))
         self.connection.ensure_connection(max_retries=self.__max_retries,
                 errback=self.on_connection_error, callback=self.on_conn_retry)
 
     def get_consumers(self, consumer, channel):
         if not isinstance(self.__callbacks,list):
             self.__callbacks = [ self.__callbacks ]
-        return [consumer(self.__queue, callbacks=self.__callbacks)]
+        queues = self.__queue if isinstance(self.__queue, list) else [ self.__queue ]
+        queue_consumer = consumer(queues, callbacks=[self.__dispatch])
+        if self.__prefetch_count:
+            queue_consumer.qos(prefetch_count=self.__prefetch_count)
+        return [queue_consumer]
+
+    def consume(self, *args, **kwargs):
+        kwargs.setdefault('safety_interval', self.__poll_interval)
+        return super(AMQPWorker, self).consume(*args, **kwargs)
+
+    def __dispatch(self, body, message):
+        self.consumed += 1
+        for callback in self.__callbacks:
+            callback(body, message)
+        if not message.acknowledged:
+            if not self.__pending:
+                self.__pending_since = time.time()
+            self.__pending.append(message)
+            if len(self.__pending) >= self.__ack_batch:
+                self.__flush_acks()
+
+    def __flush_acks(self):
+        if not self.__pending:
+            return
+        if self.connection.transport.driver_type == 'amqp':
+            last = self.__pending[-1]
+            last.channel.basic_ack(last.delivery_tag, multiple=True)
+        else:
+            # virtual transports have no multi-ack
+            for message in self.__pending:
+                message.ack()
+        self.__pending = []
+
+    def __update_backlog(self):
+        queues = self.__queue if isinstance(self.__queue, list) else [ self.__queue ]
+        try:
+            self.backlog = sum(self.__channel.queue_declare(queue=queue.name, passive=True)[1]
+                               for queue in queues)
+        except self.connection.channel_errors as e:
+            LOG.warning('queue depth check failed for {0}: {1}'.format(self.__queue, e))
+
+    def on_consume_ready(self, connection, channel, consumers, **kwargs):
+        self.__channel = channel
+
+    def on_consume_end(self, connection, channel):
+        self.__flush_acks()
+        self.__channel = None
+
+    def on_iteration(self):
+        now = time.time()
+        if self.__pending and now - self.__pending_since >= self.__ack_interval:
+            self.__flush_acks()
+        if self.__channel is not None and now - self.__backlog_checked >= self.__backlog_interval:
+            self.__backlog_checked = now
+            self.__update_backlog()
 
     def on_message(self, body, message):
         out = {
@@ -43,8 +124,7 @@ class AMQPWorker(ConsumerMixin):
             'properties':message.properties,
             'delivery_info': message.delivery_info
         }
-        LOG.info(out, json=True)
-        message.ack()
+        LOG.info(out, json=True, every=self.__log_every)
 
     def on_conn_retry(self):
         LOG.error('Retrying connection for {0}'.format(self.__amqp_url))
@@ -66,6 +146,113 @@ class AMQPWorker(ConsumerMixin):
         LOG.info('Stopping AMQP worker {0}'.format(self.__queue))
         self.should_stop = True
 
+"""
+Class to consume the same queue from several brokers, e.g. the AMQP endpoints
+of a clustered RackHD deployment, with one AMQPWorker per broker
+start() runs the first worker in the calling thread and the others in daemon threads.
+:param amqp_urls: optional list of AMQP URLs, default [amqp_url]
+Other keyword arguments are passed to every AMQPWorker.
+"""
+class ConsumerGroup(object):
+    def __init__(self, **kwargs):
+        options = dict(kwargs)
+        amqp_urls = options.pop('amqp_urls', None) or [options.get('amqp_url', AMQP_URL)]
+        options.pop('amqp_url', None)
+        self.workers = [AMQPWorker(amqp_url=url, **options) for url in amqp_urls]
+        self.__threads = []
+
+    @property
+    def consumed(self):
+        return sum(worker.consumed for worker in self.workers)
+
+    @property
+    def backlog(self):
+        # brokers whose depth is not known yet are left out
+        backlogs = [worker.backlog for worker in self.workers if worker.backlog is not None]
+        return sum(backlogs) if backlogs else None
+
+    def start(self):
+        for n, worker in enumerate(self.workers[1:]):
+            thread = Thread(target=worker.start, name='consumer-{0}'.format(n + 1))
+            thread.daemon = True
+            thread.start()
+            self.__threads.append(thread)
+        self.workers[0].start()
+        for thread in self.__threads:
+            thread.join(1)
+
+    def stop(self):
+        for worker in self.workers:
+            worker.stop()
+
+    def format_brokers(self):
+        lines = ['%-40s %9s %9s' % ('broker', 'consumed', 'backlog')]
+        for worker in self.workers:
+            # as_uri() masks the broker password
+            lines.append('%-40s %9d %9s' % (worker.connection.as_uri()[:40], worker.consumed,
+                                            '-' if worker.backlog is None else worker.backlog))
+        return '\n'.join(lines)
+
+def purge_queue(queue, amqp_url=AMQP_URL):
+    """
+    Declare a queue and drop the messages waiting in it
+    Messages a live consumer holds unacknowledged are not purged.
+    :return: number of messages purged
+    """
+    with BrokerConnection(amqp_url) as connection:
+        bound = queue(connection.default_channel)
+        bound.declare()
+        return bound.purge() or 0
+
+"""
+Class to sample broker queue depths with passive queue declares, which
+neither create nor modify the queues
+:param queues: list of queue names
+:param amqp_url: optional AMQP URL to connect, defaults from config/amqp.py
+"""
+class QueueMonitor(object):
+    def __init__(self, **kwargs):
+        self.__queues = kwargs.get('queues')
+        self.__amqp_url = kwargs.get('amqp_url',AMQP_URL)
+        if not self.__queues:
+            raise TypeError('expected queues parameter')
+        self.__connection = BrokerConnection(self.__amqp_url)
+        self.__channel = None
+        self.depths = dict((name, None) for name in self.__queues)
+        self.peaks = dict((name, None) for name in self.__queues)
+
+    def queues(self):
+        return list(self.__queues)
+
+    def __depth(self, name):
+        try:
+            if self.__channel is None:
+                self.__channel = self.__connection.channel()
+            return self.__channel.queue_declare(queue=name, passive=True)[1]
+        except self.__connection.channel_errors as e:
+            # the broker closes the channel when a passive declare fails
+            LOG.debug('queue depth check failed for {0}: {1}', name, e)
+            self.__channel = None
+        except self.__connection.connection_errors as e:
+            LOG.warning('queue depth check failed for {0}: {1}'.format(name, e))
+            self.__channel = None
+            self.__connection = self.__connection.clone()
+        return None
+
+    def sample(self):
+        """
+        :return: dict of queue name to message count, None for queues that could not be checked
+        """
+        for name in self.__queues:
+            depth = self.__depth(name)
+            self.depths[name] = depth
+            if depth is not None and (self.peaks[name] is None or depth > self.peaks[name]):
+                self.peaks[name] = depth
+        return dict(self.depths)
+
+    def close(self):
+        self.__connection.release()
+
 def run_listener(q,timeout_sec=3):
     log = Log(__name__,level='INFO')
     log.info('Run AMQP listener until ctrl-c input\n {0}'.format(q))
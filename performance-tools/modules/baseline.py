@@ -0,0 +1,68 @@
+
+from json import dump, load
+from trials import lookup, significant_difference
+from histogram import format_value
+
+# (summary keys, label) of the metrics shown side by side
+METRICS = [
+    (('throughput',), 'throughput (wf/s)'),
+    (('post_rate',), 'post rate (wf/s)'),
+    (('dropped',), 'dropped'),
+    (('latency', 'p50'), 'p50 (sec)'),
+    (('latency', 'p90'), 'p90 (sec)'),
+    (('latency', 'p99'), 'p99 (sec)'),
+    (('latency', 'p99.9'), 'p99.9 (sec)'),
+    (('latency', 'mean'), 'mean (sec)')
+]
+
+def save_result(path, result):
+    with open(path, 'w') as f:
+        dump(result, f, sort_keys=True, indent=4, separators=(',', ': '))
+
+def load_result(path):
+    with open(path) as f:
+        return load(f)
+
+def compare_results(result, baseline, max_throughput_drop=0.05, max_p99_rise=0.10):
+    """
+    Compare a run summary against a stored baseline summary
+    :param max_throughput_drop: allowed relative throughput drop, e.g. 0.05 for 5%
+    :param max_p99_rise: allowed relative p99 latency rise, e.g. 0.10 for 10%
+    :return: (rows, failures) where rows are (label, baseline, current, relative change)
+    When both summaries have a steady_state section, that is what gets compared.
+    When both are --trials summaries, a change past a tolerance only fails if it
+    is also significant across the trials (Welch's t-test, 95%).
+    """
+    old_stats, new_stats = baseline.get('trial_stats'), result.get('trial_stats')
+    def significant(metric):
+        if not isinstance(old_stats, dict) or not isinstance(new_stats, dict):
+            return True
+        return significant_difference(old_stats.get(metric), new_stats.get(metric)) is not False
+    if isinstance(result.get('steady_state'), dict) and isinstance(baseline.get('steady_state'), dict):
+        result, baseline = result['steady_state'], baseline['steady_state']
+    rows = []
+    for keys, label in METRICS:
+        old = lookup(baseline, keys)
+        new = lookup(result, keys)
+        change = None
+        if old and new is not None:
+            change = (float(new) - old) / old
+        rows.append((label, old, new, change))
+
+    failures = []
+    old, new = lookup(baseline, ('throughput',)), lookup(result, ('throughput',))
+    if old and new is not None and new < old * (1.0 - max_throughput_drop) and significant('throughput'):
+        failures.append('throughput dropped from {0:.2f} to {1:.2f} wf/s (tolerance {2:.0%})'
+                        .format(old, new, max_throughput_drop))
+    old, new = lookup(baseline, ('latency', 'p99')), lookup(result, ('latency', 'p99'))
+    if old and new is not None and new > old * (1.0 + max_p99_rise) and significant('p99'):
+        failures.append('p99 latency rose from {0:.3f} to {1:.3f} sec (tolerance {2:.0%})'
+                        .format(old, new, max_p99_rise))
+    return rows, failures
+
+def format_comparison(rows):
+    lines = ['%-18s %12s %12s %9s' % ('metric', 'baseline', 'current', 'change')]
+    for label, old, new, change in rows:
+        lines.append('%-18s %12s %12s %9s' % (label, format_value(old), format_value(new),
+                                               '-' if change is None else '%+.1f%%' % (change * 100)))
+    return '\n'.join(lines)
@@ -0,0 +1,90 @@
+
+from logger import Log
+from histogram import format_value
+
+LOG = Log(__name__)
+
+"""
+Class to search for the highest offered workflow rate that still meets a
+p99 latency and drop-rate SLO. Rates are stepped up until a step breaks the
+SLO, then optionally bisected between the last passing and first failing rate.
+:param run_step: callable taking an offered rate (wf/s) and returning a dict
+                 with 'rate', 'throughput', 'p50', 'p95', 'p99', 'drops' and 'drop_rate',
+                 optionally 'finished', 'cpu' (harness CPU seconds spent on the step) and 'max_lag'
+                 (seconds the latest post was sent behind its schedule)
+:param rate_start: first offered rate
+:param rate_step: rate increment between steps
+:param rate_max: optional upper bound on the offered rate
+:param resolution: optional bisection resolution in wf/s, 0 to disable bisection
+:param slo_p99: p99 completion latency limit in seconds
+:param slo_drop_rate: optional drop rate limit (fraction of posts), default 0.01
+"""
+class CapacityFinder(object):
+    def __init__(self, **kwargs):
+        self.__run_step = kwargs.get('run_step')
+        self.__rate_start = kwargs.get('rate_start')
+        self.__rate_step = kwargs.get('rate_step')
+        self.__rate_max = kwargs.get('rate_max')
+        self.__resolution = kwargs.get('resolution', 0)
+        self.__slo_p99 = kwargs.get('slo_p99')
+        self.__slo_drop_rate = kwargs.get('slo_drop_rate', 0.01)
+        if not hasattr(self.__run_step, '__call__'):
+            raise TypeError('expected callable run_step')
+        if not self.__rate_start > 0 or not self.__rate_step > 0:
+            raise ValueError('rate_start and rate_step must be positive')
+        if self.__slo_p99 is None:
+            raise ValueError('expected slo_p99 parameter')
+        self.results = []
+
+    def meets_slo(self, result):
+        if result['p99'] is None or result['p99'] > self.__slo_p99:
+            return False
+        return result['drop_rate'] <= self.__slo_drop_rate
+
+    def __step(self, rate):
+        LOG.info('offering {0} wf/s'.format(rate))
+        result = self.__run_step(rate)
+        result['slo'] = self.meets_slo(result)
+        self.results.append(result)
+        return result['slo']
+
+    def run(self):
+        """
+        Run the search and return the knee rate, None if even the first step broke the SLO
+        """
+        knee = None
+        failed = None
+        rate = self.__rate_start
+        while self.__rate_max is None or rate <= self.__rate_max:
+            if not self.__step(rate):
+                failed = rate
+                break
+            knee = rate
+            rate += self.__rate_step
+        if knee is not None and failed is not None and self.__resolution > 0:
+            while failed - knee > self.__resolution:
+                rate = (knee + failed) / 2.0
+                if self.__step(rate):
+                    knee = rate
+                else:
+                    failed = rate
+        return knee
+
+def format_capacity_table(results, knee):
+    def cpu_per_workflow(result):
+        if result.get('cpu') is None or not result.get('finished'):
+            return None
+        return 1000.0 * result['cpu'] / result['finished']
+    lines = ['%10s %12s %9s %9s %9s %7s %9s %10s %5s' %
+             ('rate', 'throughput', 'p50', 'p95', 'p99', 'drops', 'max lag', 'cpu ms/wf', 'slo')]
+    for result in sorted(results, key=lambda r: r['rate']):
+        lines.append('%10.2f %12.2f %9s %9s %9s %7d %9s %10s %5s' %
+                     (result['rate'], result['throughput'], format_value(result['p50']),
+                      format_value(result['p95']), format_value(result['p99']), result['drops'],
+                      format_value(result.get('max_lag')), format_value(cpu_per_workflow(result)),
+                      'ok' if result['slo'] else 'FAIL'))
+    if knee is None:
+        lines.append('knee: none, the first step already broke the SLO')
+    else:
+        lines.append('knee: {0:.2f} wf/s'.format(knee))
+    return '\n'.join(lines)
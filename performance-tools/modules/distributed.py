@@ -0,0 +1,242 @@
+
+from config.amqp import *
+from logger import Log
+from modules.amqp import ConsumerGroup
+from poster import WorkflowPoster
+from endpoints import EndpointPool
+from profiler import ThreadProfiler
+from workload import Workload
+from threading import Thread, Lock
+from multiprocessing import Process, Queue, Event
+from Queue import Empty
+import signal
+import time
+import os
+
+LOG = Log(__name__)
+
+"""
+Class to buffer a worker process' workflow events until the next flush
+It has the recording interface of WorkflowTracker so a WorkflowPoster can
+post into it directly. Graph ids are assigned by RackHD and graph.finished
+events are shared across all workers' consumers, so a completion often lands
+in a different process than its post; matching happens in the coordinator.
+"""
+class DeltaRecorder(object):
+    def __init__(self):
+        self.__lock = Lock()
+        self.__posts = []
+        self.__drops = []
+        self.__finishes = []
+        self.posted = 0
+        self.dropped = 0
+        self.consumed = 0
+
+    def add_post(self, graph_id, sent, status, graph=None, accepted=None, endpoint=None):
+        with self.__lock:
+            self.__posts.append((graph_id, sent, status, graph, accepted, endpoint))
+            self.posted += 1
+
+    def add_drop(self, sent, status, graph=None, endpoint=None):
+        with self.__lock:
+            self.__drops.append((sent, status, graph, endpoint))
+            self.dropped += 1
+
+    def add_finish(self, graph_id, finished, status=None):
+        with self.__lock:
+            self.__finishes.append((graph_id, finished, status))
+            self.consumed += 1
+
+    def flush(self):
+        with self.__lock:
+            delta = {
+                'posts': self.__posts,
+                'drops': self.__drops,
+                'finishes': self.__finishes
+            }
+            self.__posts = []
+            self.__drops = []
+            self.__finishes = []
+            return delta
+
+def run_worker(index, options, deltas, stop):
+    """
+    Worker process: post this worker's share of the workload, consume its share
+    of the graph.finished queue, and stream deltas to the coordinator until stopped
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    profiler = None
+    if options.get('profile'):
+        # ThreadProfiler keyword arguments, each worker writes to its own subdirectory
+        profile = dict(options['profile'])
+        profile['path'] = os.path.join(profile['path'], 'worker{0}'.format(index))
+        profiler = ThreadProfiler(**profile)
+        profiler.start()
+    recorder = DeltaRecorder()
+    workload = Workload.load(options['workload']) if options.get('workload') else None
+    endpoints = EndpointPool(urls=options['base_urls'], dispatch=options.get('dispatch'))
+    poster = WorkflowPoster(endpoints=endpoints, tracker=recorder,
+                            concurrency=options['concurrency'], workload=workload)
+
+    def handle_graph_finish(body, message):
+        finished = time.time()
+        graph_id = message.delivery_info.get('routing_key').split('graph.finished.')[1]
+        status = body.get('status') if isinstance(body, dict) else None
+        recorder.add_finish(graph_id, finished, status)
+
+    def post_share():
+        if options.get('rate'):
+            poster.run_rate(options['total'], options['rate'], options['arrival'], options.get('duration'))
+        else:
+            poster.run(options['total'], options.get('duration'))
+
+    consumer = ConsumerGroup(queue=QUEUE_GRAPH_FINISH, callbacks=[handle_graph_finish],
+                             amqp_urls=options.get('amqp_urls'), **options.get('amqp', {}))
+    consumer_thread = Thread(target=consumer.start, name='consumer')
+    consumer_thread.daemon = True
+    consumer_thread.start()
+    post_thread = Thread(target=post_share, name='poster-main')
+    post_thread.daemon = True
+    post_thread.start()
+
+    def send(done=False):
+        # read the post window first, a post_end implies its posts are in this delta
+        post_start, post_end = poster.post_window()
+        delta = recorder.flush()
+        delta.update({
+            'worker': index,
+            'attempted': poster.attempted,
+            'max_lag': poster.max_lag,
+            'post_start': post_start,
+            'post_end': post_end,
+            'backlog': consumer.backlog,
+            'done': done
+        })
+        deltas.put(delta)
+
+    while not stop.is_set():
+        stop.wait(options.get('flush_interval', 0.5))
+        send()
+    consumer.stop()
+    consumer_thread.join(options.get('flush_interval', 0.5) * 4)
+    if profiler is not None:
+        # before the final delta, the coordinator may exit right after it
+        profiler.stop()
+        profiler.write()
+    send(done=True)
+
+"""
+Class to run workflow posters and graph.finished consumers in several
+processes and merge their deltas into one WorkflowTracker
+:param processes: number of worker processes
+:param tracker: the WorkflowTracker all worker deltas are merged into
+:param options: dict of worker options: base_urls, dispatch, concurrency, total, duration, rate, arrival, workload,
+                amqp_urls, amqp (AMQPWorker keyword arguments), flush_interval,
+                profile (ThreadProfiler keyword arguments)
+"""
+class Coordinator(object):
+    def __init__(self, **kwargs):
+        self.__processes = kwargs.get('processes', 1)
+        self.__tracker = kwargs.get('tracker')
+        self.__options = kwargs.get('options', {})
+        if self.__processes < 1:
+            raise ValueError('processes must be at least 1')
+        if self.__tracker is None:
+            raise TypeError('expected tracker parameter')
+        self.__deltas = Queue()
+        self.__stop = Event()
+        self.__workers = []
+        self.workers = {}
+        self.backlog = None
+
+    def __share(self, index, value):
+        share = value // self.__processes
+        if index < value % self.__processes:
+            share += 1
+        return share
+
+    def start(self):
+        for index in range(self.__processes):
+            options = dict(self.__options)
+            if self.__options.get('total') is not None:
+                options['total'] = self.__share(index, self.__options['total'])
+            if options.get('rate'):
+                options['rate'] = float(options['rate']) / self.__processes
+            self.workers[index] = {'posted': 0, 'dropped': 0, 'consumed': 0, 'attempted': 0, 'max_lag': None,
+                                   'post_start': 0, 'post_end': 0, 'done': False}
+            process = Process(target=run_worker, args=(index, options, self.__deltas, self.__stop))
+            process.daemon = True
+            process.start()
+            self.__workers.append(process)
+
+    def stop(self):
+        self.__stop.set()
+
+    def __merge(self, delta):
+        for post in delta['posts']:
+            self.__tracker.add_post(*post)
+        for drop in delta['drops']:
+            self.__tracker.add_drop(*drop)
+        for finish in delta['finishes']:
+            self.__tracker.add_finish(*finish)
+        stats = self.workers[delta['worker']]
+        stats['posted'] += len(delta['posts'])
+        stats['dropped'] += len(delta['drops'])
+        stats['consumed'] += len(delta['finishes'])
+        for key in ['attempted', 'max_lag', 'post_start', 'post_end', 'done']:
+            stats[key] = delta[key]
+        if delta['backlog'] is not None:
+            # every worker consumes the same queue, the latest depth reading wins
+            self.backlog = delta['backlog']
+
+    def run(self):
+        """
+        Merge worker deltas until every worker has sent its final delta
+        """
+        while not all(stats['done'] for stats in self.workers.itervalues()):
+            try:
+                self.__merge(self.__deltas.get(timeout=1))
+            except Empty:
+                if not any(process.is_alive() for process in self.__workers):
+                    LOG.error('all worker processes exited without a final delta')
+                    break
+        for process in self.__workers:
+            process.join(1)
+
+    def post_window(self):
+        """
+        (start, end) across all workers, end is 0 while any worker is still posting
+        """
+        starts = [stats['post_start'] for stats in self.workers.itervalues() if stats['post_start']]
+        if not starts:
+            return 0, 0
+        ends = [stats['post_end'] for stats in self.workers.itervalues()]
+        return min(starts), max(ends) if all(ends) else 0
+
+    def posting_done(self):
+        start, end = self.post_window()
+        return bool(start and end)
+
+    @property
+    def max_lag(self):
+        lags = [stats['max_lag'] for stats in self.workers.itervalues() if stats['max_lag'] is not None]
+        return max(lags) if lags else None
+
+    def post_rate(self):
+        start, end = self.post_window()
+        if not start:
+            return 0.0
+        elapsed = (end or time.time()) - start
+        if elapsed <= 0:
+            return 0.0
+        return sum(stats['attempted'] for stats in self.workers.itervalues()) / elapsed
+
+    def format_workers(self):
+        lines = ['%7s %9s %9s %9s' % ('worker', 'posted', 'dropped', 'consumed')]
+        for index, stats in sorted(self.workers.iteritems()):
+            lines.append('%7d %9d %9d %9d' % (index, stats['posted'], stats['dropped'], stats['consumed']))
+        lines.append('%7s %9d %9d %9d' % ('total',
+                     sum(stats['posted'] for stats in self.workers.itervalues()),
+                     sum(stats['dropped'] for stats in self.workers.itervalues()),
+                     sum(stats['consumed'] for stats in self.workers.itervalues())))
+        return '\n'.join(lines)
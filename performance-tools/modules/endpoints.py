@@ -0,0 +1,68 @@
+
+from logger import Log
+from histogram import format_value
+from threading import Lock
+
+LOG = Log(__name__)
+
+DISPATCH = ['round_robin', 'least_outstanding']
+
+"""
+Class to spread API requests over several RackHD endpoints, e.g. the on-http
+instances of an HA deployment. round_robin hands out the endpoints in turn;
+least_outstanding picks the endpoint with the fewest requests awaiting a
+response, rotating among ties, so a slow instance gets less of the load.
+:param urls: list of API base urls, e.g. http://host:8080/api/1.1
+:param dispatch: optional 'round_robin' or 'least_outstanding', default round_robin
+"""
+class EndpointPool(object):
+    def __init__(self, **kwargs):
+        self.__urls = list(kwargs.get('urls') or [])
+        self.__dispatch = kwargs.get('dispatch') or 'round_robin'
+        if not self.__urls:
+            raise TypeError('expected urls parameter')
+        if self.__dispatch not in DISPATCH:
+            raise ValueError('unknown dispatch policy {0}'.format(self.__dispatch))
+        self.__lock = Lock()
+        self.__next = 0
+        self.outstanding = dict((url, 0) for url in self.__urls)
+        self.sent = dict((url, 0) for url in self.__urls)
+
+    def urls(self):
+        return list(self.__urls)
+
+    def acquire(self):
+        """
+        Pick the endpoint for the next request, release() it once the response arrived
+        """
+        with self.__lock:
+            count = len(self.__urls)
+            if self.__dispatch == 'least_outstanding':
+                order = [self.__urls[(self.__next + n) % count] for n in range(count)]
+                url = min(order, key=lambda url: self.outstanding[url])
+            else:
+                url = self.__urls[self.__next]
+            self.__next = (self.__next + 1) % count
+            self.outstanding[url] += 1
+            self.sent[url] += 1
+            return url
+
+    def release(self, url):
+        with self.__lock:
+            self.outstanding[url] -= 1
+
+def format_endpoint_table(endpoints, elapsed):
+    """
+    :param endpoints: dict of endpoint to posted/finished/dropped/lost/latency, see WorkflowTracker.endpoint_summaries
+    :param elapsed: seconds the run took, for the throughput column
+    """
+    attempted = sum(stats['posted'] + stats['dropped'] for stats in endpoints.itervalues())
+    lines = ['%-40s %7s %6s %9s %9s %7s %9s %9s %9s' %
+             ('endpoint', 'posted', 'share', 'finished', 'dropped', 'lost', 'Tph', 'p50', 'p99')]
+    for endpoint, stats in sorted(endpoints.iteritems()):
+        share = 100.0 * (stats['posted'] + stats['dropped']) / attempted if attempted else 0.0
+        lines.append('%-40s %7d %5.1f%% %9d %9d %7d %9.2f %9s %9s' %
+                     (str(endpoint)[:40], stats['posted'], share, stats['finished'], stats['dropped'], stats['lost'],
+                      stats['finished'] / elapsed if elapsed > 0 else 0.0,
+                      format_value(stats['latency']['p50']), format_value(stats['latency']['p99'])))
+    return '\n'.join(lines)
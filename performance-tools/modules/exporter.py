@@ -0,0 +1,97 @@
+
+from json import dumps
+import csv
+import os
+import tempfile
+
+SERIES_FIELDS = ['timestamp', 'posted', 'finished', 'dropped', 'in_flight', 'backlog', 'throughput',
+                 'p50', 'p90', 'p99', 'p99.9']
+# broker queue depths are recorded as depth.<queue name>
+DEPTH_PREFIX = 'depth.'
+
+"""
+Class to append one record per sampling window to a CSV or JSONL file
+Every record is flushed as it is written so a killed run keeps its series.
+:param path: output file, JSONL if it ends with .jsonl/.json, CSV otherwise
+:param fields: optional list of record fields, default SERIES_FIELDS
+"""
+class SeriesWriter(object):
+    def __init__(self, path, fields=None):
+        self.__fields = fields or SERIES_FIELDS
+        self.__jsonl = path.endswith(('.jsonl', '.json'))
+        self.__file = open(path, 'w' if self.__jsonl else 'wb')
+        if not self.__jsonl:
+            self.__csv = csv.DictWriter(self.__file, self.__fields, extrasaction='ignore')
+            self.__csv.writeheader()
+            self.__file.flush()
+
+    def write(self, record):
+        if self.__jsonl:
+            self.__file.write(dumps(dict((key, record.get(key)) for key in self.__fields),
+                                    sort_keys=True, separators=(',', ':')) + '\n')
+        else:
+            self.__csv.writerow(dict((key, '' if record.get(key) is None else record.get(key))
+                                     for key in self.__fields))
+        self.__file.flush()
+
+    def close(self):
+        self.__file.close()
+
+"""
+Class to publish the latest run metrics as a Prometheus text format file
+The file is rewritten atomically (write to a temp file, then rename) so a
+node_exporter textfile collector never reads a partial file.
+:param path: the .prom output file
+:param prefix: optional metric name prefix, default rackhd_perf
+"""
+class MetricsFile(object):
+    def __init__(self, path, prefix='rackhd_perf'):
+        self.__path = path
+        self.__prefix = prefix
+
+    def __metric(self, lines, name, kind, help, samples):
+        name = '{0}_{1}'.format(self.__prefix, name)
+        lines.append('# HELP {0} {1}'.format(name, help))
+        lines.append('# TYPE {0} {1}'.format(name, kind))
+        for labels, value in samples:
+            if value is None:
+                continue
+            lines.append('{0}{1} {2}'.format(name, labels, repr(float(value))))
+
+    def write(self, record, latency):
+        """
+        :param record: the latest series record
+        :param latency: cumulative LatencyHistogram summary
+        """
+        lines = []
+        self.__metric(lines, 'workflows_posted_total', 'counter', 'Workflows posted to RackHD',
+                      [('', record['posted'])])
+        self.__metric(lines, 'workflows_finished_total', 'counter', 'Workflows finished by RackHD',
+                      [('', record['finished'])])
+        self.__metric(lines, 'workflows_dropped_total', 'counter', 'Workflow posts that failed',
+                      [('', record['dropped'])])
+        self.__metric(lines, 'workflows_in_flight', 'gauge', 'Workflows posted but not yet finished',
+                      [('', record['in_flight'])])
+        self.__metric(lines, 'consumer_backlog', 'gauge', 'graph.finished messages waiting in the broker',
+                      [('', record.get('backlog'))])
+        self.__metric(lines, 'queue_depth', 'gauge', 'Messages waiting in a broker queue',
+                      [('{{queue="{0}"}}'.format(key[len(DEPTH_PREFIX):]), value)
+                       for key, value in sorted(record.iteritems()) if key.startswith(DEPTH_PREFIX)])
+        self.__metric(lines, 'window_throughput', 'gauge', 'Finished workflows/sec over the last sampling window',
+                      [('', record['throughput'])])
+        quantiles = [('{{quantile="{0}"}}'.format(q), latency.get('p{0:g}'.format(q * 100)))
+                     for q in [0.5, 0.9, 0.99, 0.999]]
+        quantiles.append(('_sum', (latency['mean'] or 0.0) * latency['count']))
+        quantiles.append(('_count', latency['count']))
+        self.__metric(lines, 'workflow_latency_seconds', 'summary', 'End-to-end workflow latency', quantiles)
+
+        directory = os.path.dirname(os.path.abspath(self.__path))
+        fd, tmp = tempfile.mkstemp(prefix='.metrics', dir=directory)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            os.chmod(tmp, 0o644)
+            os.rename(tmp, self.__path)
+        except:
+            os.remove(tmp)
+            raise
@@ -0,0 +1,59 @@
+
+from logger import Log
+from threading import Lock, Timer
+import imp
+import os
+
+LOG = Log(__name__)
+
+# footprint-benchmark is a sibling tool in this repository, not an installed package
+CASE_RECORDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..',
+                             'footprint-benchmark', 'utils', 'case_recorder.py')
+
+try:
+    case_recorder = imp.load_source('case_recorder', CASE_RECORDER)
+except IOError:
+    case_recorder = None
+
+"""
+Class to write load phase markers into a footprint-benchmark case directory
+with footprint-benchmark's caseRecorder, so its report shows where each phase
+falls on the CPU/memory/disk graphs. The case's own start and end markers
+belong to the footprint data collection and are left alone.
+:param path: case directory, as printed by footprint-benchmark's benchmark.py --getdir
+:param prefix: optional marker name prefix, default 'perf'
+"""
+class FootprintMarkers(object):
+    def __init__(self, **kwargs):
+        path = kwargs.get('path')
+        self.__prefix = kwargs.get('prefix', 'perf')
+        if path is None:
+            raise TypeError('expected path parameter')
+        if case_recorder is None:
+            raise ImportError('footprint-benchmark is required to write markers, {0} not found'.format(CASE_RECORDER))
+        # caseRecorder takes the log path and case name from the last two path components
+        path = os.path.normpath(os.path.abspath(path))
+        if not os.path.exists(os.path.join(path, 'case_info.log')):
+            LOG.warning('{0} is not a started footprint-benchmark case, writing markers anyway'.format(path))
+        self.__lock = Lock()
+        self.__recorder = case_recorder.caseRecorder(path)
+        self.__timers = []
+
+    def mark(self, name):
+        key = '{0} {1}'.format(self.__prefix, name)
+        with self.__lock:
+            self.__recorder.write_event(key)
+
+    def mark_after(self, delay, name):
+        """
+        Write a marker delay seconds from now, unless cancel() is called first
+        """
+        timer = Timer(delay, self.mark, args=(name,))
+        timer.daemon = True
+        timer.start()
+        self.__timers.append(timer)
+
+    def cancel(self):
+        for timer in self.__timers:
+            timer.cancel()
+        self.__timers = []
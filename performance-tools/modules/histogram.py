@@ -0,0 +1,115 @@
+
+from array import array
+import math
+
+PERCENTILES = [50, 90, 99, 99.9]
+
+"""
+Class to record latencies into logarithmic buckets (HDR style)
+Memory is fixed by the tracked range and precision, not by the number of
+recorded values, so multi-hour runs do not grow the process. Percentiles are
+accurate to within the relative bucket width.
+:param min_value: optional smallest distinguishable latency in seconds, default 0.001
+:param max_value: optional largest tracked latency in seconds, default 86400
+:param precision: optional relative bucket width, default 0.01 (1%)
+"""
+class LatencyHistogram(object):
+    def __init__(self, **kwargs):
+        self.__min_value = kwargs.get('min_value', 0.001)
+        self.__max_value = kwargs.get('max_value', 86400.0)
+        self.__precision = kwargs.get('precision', 0.01)
+        if not 0 < self.__min_value < self.__max_value:
+            raise ValueError('expected 0 < min_value < max_value')
+        self.__log_base = math.log(1.0 + self.__precision)
+        # bucket 0 holds values below min_value, the last bucket values above max_value
+        size = int(math.log(self.__max_value / self.__min_value) / self.__log_base) + 2
+        self.__buckets = array('L', [0] * size)
+        self.reset()
+
+    def reset(self):
+        for n in range(len(self.__buckets)):
+            self.__buckets[n] = 0
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = None
+        self.max = None
+
+    def __index(self, value):
+        if value < self.__min_value:
+            return 0
+        index = int(math.log(value / self.__min_value) / self.__log_base) + 1
+        return min(index, len(self.__buckets) - 1)
+
+    def __bucket_value(self, index):
+        if index == 0:
+            return self.__min_value
+        return self.__min_value * math.pow(1.0 + self.__precision, index - 0.5)
+
+    def record(self, value):
+        self.__buckets[self.__index(value)] += 1
+        self.count += 1
+        self.total += value
+        self.total_sq += value * value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if len(other.__buckets) != len(self.__buckets):
+            raise ValueError('cannot merge histograms with different bucket layouts')
+        for n, bucket in enumerate(other.__buckets):
+            if bucket:
+                self.__buckets[n] += bucket
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        if other.max is not None and (self.max is None or other.max > self.max):
+            self.max = other.max
+
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / self.count
+
+    def stddev(self):
+        if not self.count:
+            return None
+        mean = self.total / self.count
+        return math.sqrt(max(self.total_sq / self.count - mean * mean, 0.0))
+
+    def percentile(self, p):
+        if not self.count:
+            return None
+        rank = max(int(math.ceil(p / 100.0 * self.count)), 1)
+        seen = 0
+        for n, bucket in enumerate(self.__buckets):
+            seen += bucket
+            if seen >= rank:
+                return min(max(self.__bucket_value(n), self.min), self.max)
+        return self.max
+
+    def summary(self):
+        out = {
+            'count': self.count,
+            'mean': self.mean(),
+            'stddev': self.stddev(),
+            'min': self.min,
+            'max': self.max
+        }
+        for p in PERCENTILES:
+            out['p{0:g}'.format(p)] = self.percentile(p)
+        return out
+
+def format_value(value):
+    """
+    Table cell of a value in seconds or a rate, '-' when it is not known
+    """
+    return '-' if value is None else '%.3f' % value
+
+def format_summary(summary):
+    keys = ['p{0:g}'.format(p) for p in PERCENTILES] + ['mean', 'stddev', 'max']
+    return ' '.join('{0}={1}sec'.format(key, format_value(summary[key])) for key in keys)
@@ -0,0 +1,126 @@
+
+from logger import Log
+from histogram import LatencyHistogram, format_value
+from threading import Lock
+import time
+
+LOG = Log(__name__)
+
+PHASES = ['api_accept', 'scheduler_wait', 'execution']
+
+"""
+Class to correlate graph and task lifecycle events by graph id and split each
+finished workflow's latency into phases:
+  api_accept     - workflow POST sent until RackHD's response
+  scheduler_wait - POST response until the first task is dispatched (or the graph starts)
+  execution      - first task dispatch (or graph start) until graph.finished
+Task execution (dispatch or task.started until task.finished) is aggregated
+per task name. Lifecycle events arrive on their own consumer and can trail
+graph.finished, so a finished graph is settled after a short grace period.
+:param grace: optional seconds a finished graph waits for trailing events, default 2
+:param max_age: optional seconds after which state of never finished graphs is dropped, default 600
+"""
+class LifecycleTracker(object):
+    def __init__(self, **kwargs):
+        self.__grace = kwargs.get('grace', 2)
+        self.__max_age = kwargs.get('max_age', 600)
+        self.__lock = Lock()
+        self.__graphs = {}
+        self.__settled = time.time()
+        self.events = 0
+        self.phases = dict((phase, LatencyHistogram()) for phase in PHASES)
+        self.tasks = {}
+
+    def __graph(self, graph_id, now):
+        state = self.__graphs.get(graph_id)
+        if state is None:
+            state = self.__graphs[graph_id] = {'seen': now, 'started': None, 'dispatched': None, 'tasks': {},
+                                               'accepted': None, 'finished': None}
+        return state
+
+    def __task_name(self, body, default='unknown'):
+        for key in ['taskName', 'injectableName', 'name']:
+            if body.get(key):
+                return body[key]
+        return default
+
+    def handle_event(self, body, message):
+        now = time.time()
+        routing_key = message.delivery_info.get('routing_key', '')
+        if not isinstance(body, dict):
+            body = {}
+        with self.__lock:
+            self.events += 1
+            if routing_key.startswith('graph.started.'):
+                graph_id = body.get('graphId') or routing_key.split('graph.started.')[1]
+                self.__graph(graph_id, now)['started'] = now
+            elif body.get('graphId') and body.get('taskId'):
+                state = self.__graph(body['graphId'], now)
+                if routing_key.startswith('task.finished.'):
+                    self.__task_finished(state, body, now)
+                else:
+                    # run.<id> dispatch from the scheduler or task.started from the runner
+                    if state['dispatched'] is None:
+                        state['dispatched'] = now
+                    task = state['tasks'].setdefault(body['taskId'], [now, None])
+                    task[1] = self.__task_name(body, task[1])
+            if now - self.__settled > 1:
+                self.__settle(now, self.__grace)
+
+    def __task_finished(self, state, body, now):
+        started, name = state['tasks'].pop(body['taskId'], [None, None])
+        if started is None:
+            return
+        name = self.__task_name(body, name or 'unknown')
+        histogram = self.tasks.get(name)
+        if histogram is None:
+            histogram = self.tasks[name] = LatencyHistogram()
+        histogram.record(now - started)
+
+    def __settle(self, now, grace):
+        self.__settled = now
+        for graph_id, state in self.__graphs.items():
+            if state['finished'] is not None:
+                if now - state['seen'] >= grace:
+                    self.__record_phases(state)
+                    del self.__graphs[graph_id]
+            elif now - state['seen'] > self.__max_age:
+                del self.__graphs[graph_id]
+
+    def __record_phases(self, state):
+        began = state['dispatched'] or state['started']
+        if began is None:
+            return
+        if state['accepted'] is not None:
+            self.phases['scheduler_wait'].record(max(began - state['accepted'], 0.0))
+        self.phases['execution'].record(max(state['finished'] - began, 0.0))
+
+    def complete(self, record):
+        """
+        Record the phase breakdown of a finished WorkflowRecord once trailing events had time to arrive
+        """
+        now = time.time()
+        with self.__lock:
+            if record.accepted is not None:
+                self.phases['api_accept'].record(record.accepted - record.sent)
+            state = self.__graph(record.graph_id, now)
+            state['seen'] = now
+            state['accepted'] = record.accepted
+            state['finished'] = record.finished
+
+    def summaries(self):
+        with self.__lock:
+            self.__settle(time.time(), 0)
+            return (dict((phase, histogram.summary()) for phase, histogram in self.phases.iteritems()),
+                    dict((name, histogram.summary()) for name, histogram in self.tasks.iteritems()))
+
+def format_breakdown(phases, tasks):
+    lines = ['%-40s %8s %9s %9s %9s' % ('phase / task', 'count', 'mean', 'p50', 'p99')]
+    for phase in PHASES:
+        summary = phases[phase]
+        lines.append('%-40s %8d %9s %9s %9s' % (phase, summary['count'], format_value(summary['mean']),
+                                                format_value(summary['p50']), format_value(summary['p99'])))
+    for name, summary in sorted(tasks.iteritems(), key=lambda item: -(item[1]['mean'] or 0)):
+        lines.append('%-40s %8d %9s %9s %9s' % ('  ' + name[:38], summary['count'], format_value(summary['mean']),
+                                                format_value(summary['p50']), format_value(summary['p99'])))
+    return '\n'.join(lines)
@@ -2,9 +2,96 @@
 from config.settings import *
 import logging
 from json import dumps,loads
+from threading import Thread
+from Queue import Queue, Full
+from itertools import count
+import os
+
+"""
+Class to render a log message only when a handler emits it, so disabled
+levels and the calling thread never pay for formatting or serialization
+:param m: message, a str.format template when args are given
+:param args: optional format arguments
+:param json: serialize m as compact single-line JSON
+"""
+class LazyMessage(object):
+    __slots__ = ('m', 'args', 'json')
+
+    def __init__(self, m, args=(), json=False):
+        self.m = m
+        self.args = args
+        self.json = json
+
+    def __str__(self):
+        if self.json:
+            return dumps(self.m, sort_keys=True, separators=(',', ':'), default=repr)
+        return self.m.format(*self.args)
+
+"""
+Class to hand log records to a background thread that formats them and
+writes them through the wrapped handlers. Records are dropped (and counted)
+rather than blocking the caller when the queue is full.
+:param handlers: list of handlers records are passed to
+:param capacity: optional max number of queued records, default LOGGER_QUEUE_SIZE
+"""
+class AsyncHandler(logging.Handler):
+    def __init__(self, handlers, capacity=LOGGER_QUEUE_SIZE):
+        logging.Handler.__init__(self)
+        self.__handlers = handlers
+        self.__capacity = capacity
+        self.dropped = 0
+        self.__start()
+
+    def __start(self):
+        self.__pid = os.getpid()
+        self.__queue = Queue(self.__capacity)
+        self.__thread = Thread(target=self.__run, name='logger')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def emit(self, record):
+        if self.__pid != os.getpid():
+            # forked worker process, the writer thread did not survive the fork
+            self.__start()
+        try:
+            self.__queue.put_nowait(record)
+        except Full:
+            self.dropped += 1
+
+    def __run(self):
+        while True:
+            record = self.__queue.get()
+            if record is None:
+                break
+            for handler in self.__handlers:
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+    def close(self):
+        # logging.shutdown() closes handlers at exit, write out what is queued first
+        if self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join(5)
+        if self.dropped:
+            self.__handlers[0].handle(logging.makeLogRecord({
+                'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+                'msg': 'async log queue full, {0} records dropped'.format(self.dropped)}))
+        for handler in self.__handlers:
+            handler.close()
+        logging.Handler.close(self)
+
+def _install_async_handler():
+    root = logging.getLogger()
+    if LOGGER_ASYNC and root.handlers and not isinstance(root.handlers[0], AsyncHandler):
+        root.handlers = [AsyncHandler(root.handlers[:])]
+
+_install_async_handler()
 
 """
 Class to abstract python logging functionality
+Messages are formatted lazily: LOG.info('posted {0}', graph_id) and
+LOG.info(obj, json=True) cost nothing unless the level is enabled.
+Pass every=N to log only every Nth call of a high-rate message.
 :param name: optional logging name
 :param level: optional logging level, default defined in config/settings.py
 """
@@ -14,26 +101,28 @@ class Log(object):
         self._level = kwargs.get('level',LOGGER_LVL)
         self._logger = logging.getLogger(self._name)
         self._logger.setLevel(LOGLEVELS[self._level])
+        self._calls = count()
 
-    def critical(self,m,json=False):
-        self.__log('critical',m,json)
-
-    def info(self,m,json=False):
-        self.__log('info',m,json)
-
-    def debug(self,m,json=False):
-        self.__log('debug',m,json)
+    def critical(self,m,*args,**kwargs):
+        self.__log(logging.CRITICAL,m,args,**kwargs)
 
-    def error(self,m,json=False):
-        self.__log('error',m,json)
+    def info(self,m,*args,**kwargs):
+        self.__log(logging.INFO,m,args,**kwargs)
 
-    def warning(self,m,json=False):
-        self.__log('warning',m,json)
+    def debug(self,m,*args,**kwargs):
+        self.__log(logging.DEBUG,m,args,**kwargs)
 
-    def __log(self,attr,m,json=False):
-        if json:
-            m = dumps(m,sort_keys=True,indent=4,separators=(',', ': ')) \
-                    .decode('string-escape')
-        return getattr(self._logger,attr)(m)
+    def error(self,m,*args,**kwargs):
+        self.__log(logging.ERROR,m,args,**kwargs)
 
+    def warning(self,m,*args,**kwargs):
+        self.__log(logging.WARNING,m,args,**kwargs)
 
+    def __log(self,level,m,args,json=False,every=1):
+        if not self._logger.isEnabledFor(level):
+            return
+        if every > 1 and next(self._calls) % every:
+            return
+        if json or args:
+            m = LazyMessage(m,args,json)
+        self._logger.log(level,m)
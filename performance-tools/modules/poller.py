@@ -0,0 +1,196 @@
+
+from logger import Log
+from histogram import LatencyHistogram, format_value
+from threading import Lock
+from array import array
+import requests
+import time
+
+LOG = Log(__name__)
+
+# an interval this many times the configured one counts the polls in between as missed
+MISSED_FACTOR = 1.5
+
+def _percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * p / 100.0), len(ordered) - 1)]
+
+def fetch_poller_intervals(base_url):
+    """
+    Read the configured poll interval of every IPMI poller from the RackHD API
+    :return: dict of poller id to (node, command, interval seconds)
+    """
+    r = requests.get('{0}/pollers'.format(base_url))
+    r.raise_for_status()
+    pollers = {}
+    for poller in r.json():
+        config = poller.get('config') or {}
+        if poller.get('pollInterval') and config.get('command'):
+            pollers[poller['id']] = (poller.get('node'), config['command'], poller['pollInterval'] / 1000.0)
+    return pollers
+
+"""
+Class to hold the result arrivals of one (node, command) poller
+"""
+class PollState(object):
+    __slots__ = ('configured', 'first', 'last', 'count', 'intervals', 'missed')
+
+    def __init__(self, configured):
+        self.configured = configured
+        self.first = None
+        self.last = None
+        self.count = 0
+        self.intervals = array('d')
+        self.missed = 0
+
+"""
+Class to measure IPMI poller results per node and command: result rate, the
+actual polling interval against the configured one, interval jitter and
+missed polls. Per poller only the intervals are kept, in a typed array;
+jitter across all pollers of a command goes into a histogram.
+:param pollers: optional dict of poller id to (node, command, interval) from fetch_poller_intervals
+:param interval: optional configured poll interval in seconds for pollers not in pollers
+"""
+class PollerTracker(object):
+    def __init__(self, **kwargs):
+        self.__pollers = kwargs.get('pollers') or {}
+        self.__interval = kwargs.get('interval')
+        self.__lock = Lock()
+        self.__configured = dict(((node, command), interval)
+                                 for node, command, interval in self.__pollers.itervalues())
+        self.states = {}
+        self.jitter = {}
+        self.results = 0
+        self.unknown = 0
+        self.start_time = time.time()
+        # configured pollers that never deliver a result still show up, as all missed
+        for key, interval in self.__configured.iteritems():
+            self.states[key] = PollState(interval)
+
+    def __missed(self, state, now):
+        # polls missed between results, plus those due since the last result
+        if not state.configured:
+            return state.missed
+        gap = now - (state.last or self.start_time)
+        if gap < MISSED_FACTOR * state.configured:
+            return state.missed
+        return state.missed + int(gap / state.configured)
+
+    def __identify(self, body, routing_key):
+        # ipmi.command.<command>.result.<poller id> on on.task,
+        # poller.alert.<command>.<...> on on.events
+        parts = routing_key.split('.')
+        if routing_key.startswith('ipmi.command.') and len(parts) >= 5:
+            command, poller_id = parts[2], '.'.join(parts[4:])
+        elif routing_key.startswith('poller.alert.') and len(parts) >= 3:
+            command, poller_id = 'alert.' + parts[2], '.'.join(parts[3:])
+        else:
+            return None, None
+        node = body.get('node') if isinstance(body, dict) else None
+        if node is None and poller_id in self.__pollers:
+            node = self.__pollers[poller_id][0]
+        return node or poller_id or 'unknown', command
+
+    def handle_result(self, body, message):
+        now = time.time()
+        node, command = self.__identify(body, message.delivery_info.get('routing_key', ''))
+        with self.__lock:
+            self.results += 1
+            if command is None:
+                self.unknown += 1
+                return
+            key = (node, command)
+            state = self.states.get(key)
+            if state is None:
+                configured = None
+                if not command.startswith('alert.'):
+                    configured = self.__configured.get(key, self.__interval)
+                state = self.states[key] = PollState(configured)
+            if state.last is not None:
+                interval = now - state.last
+                state.intervals.append(interval)
+                if state.configured:
+                    histogram = self.jitter.get(command)
+                    if histogram is None:
+                        histogram = self.jitter[command] = LatencyHistogram(max_value=3600.0)
+                    histogram.record(abs(interval - state.configured))
+                    if interval >= MISSED_FACTOR * state.configured:
+                        state.missed += int(round(interval / state.configured)) - 1
+            else:
+                state.first = now
+            state.last = now
+            state.count += 1
+
+    def poller_summaries(self):
+        """
+        :return: list of per (node, command) dicts, worst p99 jitter first
+        """
+        now = time.time()
+        elapsed = now - self.start_time
+        rows = []
+        with self.__lock:
+            for (node, command), state in self.states.iteritems():
+                intervals = list(state.intervals)
+                jitter = [abs(interval - state.configured) for interval in intervals] if state.configured else []
+                rows.append({
+                    'node': node,
+                    'command': command,
+                    'results': state.count,
+                    'rate': state.count / elapsed if elapsed > 0 else 0.0,
+                    'configured': state.configured,
+                    'interval': sum(intervals) / len(intervals) if intervals else None,
+                    'jitter_p50': _percentile(jitter, 50),
+                    'jitter_p99': _percentile(jitter, 99),
+                    'missed': self.__missed(state, now)
+                })
+        rows.sort(key=lambda row: (-(row['jitter_p99'] or 0), row['node'], row['command']))
+        return rows
+
+    def command_summaries(self):
+        """
+        :return: dict of command to totals across all nodes
+        """
+        now = time.time()
+        elapsed = now - self.start_time
+        commands = {}
+        with self.__lock:
+            for (node, command), state in self.states.iteritems():
+                totals = commands.setdefault(command, {'nodes': 0, 'results': 0, 'missed': 0,
+                                                       'interval_sum': 0.0, 'intervals': 0})
+                totals['nodes'] += 1
+                totals['results'] += state.count
+                totals['missed'] += self.__missed(state, now)
+                totals['interval_sum'] += sum(state.intervals)
+                totals['intervals'] += len(state.intervals)
+            for command, totals in commands.iteritems():
+                totals['rate'] = totals['results'] / elapsed if elapsed > 0 else 0.0
+                interval_sum, intervals = totals.pop('interval_sum'), totals.pop('intervals')
+                totals['interval'] = interval_sum / intervals if intervals else None
+                jitter = self.jitter.get(command)
+                totals['jitter'] = jitter.summary() if jitter is not None else None
+        return commands
+
+def format_poller_table(commands, rows, top=20):
+    lines = ['%-24s %7s %9s %9s %11s %9s %9s %9s %7s' %
+             ('command', 'nodes', 'results', 'rate/s', 'interval', 'jit p50', 'jit p99', 'jit max', 'missed')]
+    for command, totals in sorted(commands.iteritems()):
+        jitter = totals['jitter'] or {}
+        lines.append('%-24s %7d %9d %9.2f %11s %9s %9s %9s %7d' %
+                     (command, totals['nodes'], totals['results'], totals['rate'], format_value(totals['interval']),
+                      format_value(jitter.get('p50')), format_value(jitter.get('p99')),
+                      format_value(jitter.get('max')), totals['missed']))
+    if rows:
+        lines.append('')
+        lines.append('%-38s %-14s %7s %11s %11s %9s %9s %7s' %
+                     ('node (worst jitter first)', 'command', 'results', 'interval', 'configured',
+                      'jit p50', 'jit p99', 'missed'))
+        for row in rows[:top]:
+            lines.append('%-38s %-14s %7d %11s %11s %9s %9s %7d' %
+                         (row['node'][:38], row['command'][:14], row['results'], format_value(row['interval']),
+                          format_value(row['configured']), format_value(row['jitter_p50']),
+                          format_value(row['jitter_p99']), row['missed']))
+        if len(rows) > top:
+            lines.append('... {0} more pollers'.format(len(rows) - top))
+    return '\n'.join(lines)
@@ -0,0 +1,262 @@
+
+from logger import Log
+from workload import Workload
+from endpoints import EndpointPool
+from threading import Thread, Lock
+from requests.adapters import HTTPAdapter
+from Queue import Queue
+from itertools import islice, takewhile
+import requests
+import random
+import time
+
+LOG = Log(__name__)
+
+ARRIVALS = ['constant', 'poisson']
+
+def arrival_offsets(rate, arrival='constant'):
+    """
+    Generate send offsets (seconds from start) for an open-loop arrival process
+    :param rate: offered load in workflows/sec
+    :param arrival: 'constant' for fixed spacing, 'poisson' for exponential inter-arrival times
+    """
+    if rate <= 0:
+        raise ValueError('arrival rate must be positive')
+    if arrival not in ARRIVALS:
+        raise ValueError('unknown arrival process {0}'.format(arrival))
+    offset = 0.0
+    while True:
+        yield offset
+        if arrival == 'poisson':
+            offset += random.expovariate(rate)
+        else:
+            offset += 1.0 / rate
+
+"""
+Class to post workflows to RackHD from a pool of threads that share one
+keep-alive HTTP session, with a connection pool per endpoint
+:param base_url: RackHD API base url, e.g. http://localhost:8080/api/1.1
+:param endpoints: optional EndpointPool to spread the posts over several API base urls, instead of base_url
+:param tracker: WorkflowTracker updated with every posted workflow
+:param concurrency: optional number of posting threads and pooled connections
+:param workload: optional Workload to sample graphs from, default Graph.noop-example
+:param trace: optional TraceRecorder every posted workflow is recorded to
+"""
+class WorkflowPoster(object):
+    def __init__(self, **kwargs):
+        self.__endpoints = kwargs.get('endpoints')
+        self.__tracker = kwargs.get('tracker')
+        self.__concurrency = kwargs.get('concurrency', 1)
+        self.__workload = kwargs.get('workload') or Workload.default()
+        self.__trace = kwargs.get('trace')
+        if self.__endpoints is None and kwargs.get('base_url') is not None:
+            self.__endpoints = EndpointPool(urls=[kwargs.get('base_url')])
+        if self.__endpoints is None or self.__tracker is None:
+            raise TypeError('expected base_url or endpoints and tracker parameters')
+        if self.__concurrency < 1:
+            raise ValueError('concurrency must be at least 1')
+        self.__session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.__endpoints.urls()), pool_maxsize=self.__concurrency)
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
+        self.__lock = Lock()
+        self.__remaining = 0
+        self.__deadline = None
+        self.__cancels = None
+        self.__cancel_thread = None
+        self.attempted = 0
+        self.max_lag = None
+        self.start_time = 0
+        self.end_time = 0
+        self.cancelled = 0
+
+    def post(self, path, data=None, headers=None, base_url=None):
+        if base_url is None:
+            base_url = self.__endpoints.urls()[0]
+        return self.__session.post(base_url + path, data, headers=headers)
+
+    def cancel_workflow(self, graph_id):
+        """
+        Ask RackHD to cancel a workflow instance
+        :return: True if RackHD accepted the cancel
+        """
+        base_url = self.__endpoints.acquire()
+        try:
+            r = self.__session.delete('{0}/workflows/{1}'.format(base_url, graph_id))
+        except requests.exceptions.RequestException as e:
+            LOG.error('cancel of workflow {0} failed: {1}'.format(graph_id, e))
+            return False
+        finally:
+            self.__endpoints.release(base_url)
+        if r.status_code >= 300:
+            LOG.error('cancel of workflow {0} failed with HTTP {1}'.format(graph_id, r.status_code))
+            return False
+        return True
+
+    def cancel_later(self, graph_id):
+        """
+        Queue a cancel_workflow() call for a background thread, so the caller does not wait on the API
+        """
+        with self.__lock:
+            if self.__cancel_thread is None:
+                self.__cancels = Queue()
+                self.__cancel_thread = Thread(target=self.__cancel_loop, name='poster-cancel')
+                self.__cancel_thread.daemon = True
+                self.__cancel_thread.start()
+        self.__cancels.put(graph_id)
+
+    def __cancel_loop(self):
+        while True:
+            graph_id = self.__cancels.get()
+            if graph_id is None:
+                break
+            if self.cancel_workflow(graph_id):
+                self.cancelled += 1
+
+    def stop_cancels(self, timeout=None):
+        """
+        Let the queued cancels finish, waiting at most timeout seconds
+        """
+        with self.__lock:
+            thread, self.__cancel_thread = self.__cancel_thread, None
+        if thread is not None:
+            self.__cancels.put(None)
+            thread.join(timeout)
+
+    def post_workflow(self, intended=None, graph=None):
+        sent = time.time()
+        if intended is not None:
+            # measure from the scheduled send time so a backed up poster
+            # does not hide queueing delay (coordinated omission)
+            if self.max_lag is None or sent - intended > self.max_lag:
+                self.max_lag = sent - intended
+            sent = intended
+        if graph is None:
+            graph = self.__workload.sample()
+        path, data = graph.request()
+        if self.__trace is not None:
+            self.__trace.record(sent, graph.name, path, data)
+        headers = {'Content-Type': 'application/json'} if data is not None else None
+        base_url = self.__endpoints.acquire()
+        try:
+            r = self.post(path, data, headers=headers, base_url=base_url)
+        except requests.exceptions.RequestException as e:
+            LOG.error('workflow post to {0} failed: {1}'.format(base_url, e))
+            self.__tracker.add_drop(sent, None, graph.name, base_url)
+            return
+        finally:
+            self.__endpoints.release(base_url)
+        if r.status_code != 201:
+            self.__tracker.add_drop(sent, r.status_code, graph.name, base_url)
+            return
+        try:
+            graph_id = r.json()['instanceId']
+        except (ValueError, KeyError, TypeError) as e:
+            LOG.error('workflow post to {0} returned no instanceId: {1}'.format(base_url, e))
+            self.__tracker.add_drop(sent, r.status_code, graph.name, base_url)
+            return
+        self.__tracker.add_post(graph_id, sent, r.status_code, graph.name, time.time(), base_url)
+
+    def __next(self):
+        with self.__lock:
+            if self.__remaining <= 0:
+                return False
+            if self.__deadline is not None and time.time() >= self.__deadline:
+                return False
+            self.__remaining -= 1
+            self.attempted += 1
+            return True
+
+    def __post_loop(self):
+        while self.__next():
+            self.post_workflow()
+
+    def __schedule_loop(self, jobs):
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            self.post_workflow(*job)
+
+    def __start_threads(self, target, args=()):
+        threads = []
+        for n in range(self.__concurrency):
+            thread = Thread(target=target, args=args, name='poster-{0}'.format(n))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def run(self, total=None, duration=None):
+        """
+        Closed-loop: each thread posts the next workflow as soon as its last post returns
+        :param total: optional number of workflows to post
+        :param duration: optional seconds to keep posting, whichever of the two ends first
+        """
+        if total is None and duration is None:
+            raise TypeError('expected total or duration parameter')
+        self.__remaining = float('inf') if total is None else total
+        # post_rate() and max_lag cover this run only
+        self.attempted = 0
+        self.max_lag = None
+        self.start_time = time.time()
+        self.__deadline = None if duration is None else self.start_time + duration
+        self.end_time = 0
+        for thread in self.__start_threads(self.__post_loop):
+            thread.join()
+        self.end_time = time.time()
+
+    def run_schedule(self, offsets):
+        """
+        Open-loop: hand each workflow to the posting threads at its wall-clock
+        deadline, whether or not earlier posts have returned
+        :param offsets: iterable of send offsets in seconds from the start of the run, or of
+                        (offset, GraphSpec) pairs to post a given graph instead of sampling the workload
+        """
+        jobs = Queue()
+        self.attempted = 0
+        self.max_lag = None
+        self.start_time = time.time()
+        self.end_time = 0
+        threads = self.__start_threads(self.__schedule_loop, (jobs,))
+        for offset in offsets:
+            offset, graph = offset if isinstance(offset, tuple) else (offset, None)
+            deadline = self.start_time + offset
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            with self.__lock:
+                self.attempted += 1
+            jobs.put((deadline, graph))
+        for thread in threads:
+            jobs.put(None)
+        for thread in threads:
+            thread.join()
+        self.end_time = time.time()
+
+    def run_rate(self, total, rate, arrival='constant', duration=None):
+        if total is None and duration is None:
+            raise TypeError('expected total or duration parameter')
+        offsets = arrival_offsets(rate, arrival)
+        if duration is not None:
+            offsets = takewhile(lambda offset: offset < duration, offsets)
+        if total is not None:
+            offsets = islice(offsets, total)
+        self.run_schedule(offsets)
+
+    def post_window(self):
+        """
+        (start, end) of the last run, end is 0 while it is still posting
+        """
+        return self.start_time, self.end_time
+
+    def posting_done(self):
+        return bool(self.start_time and self.end_time)
+
+    def post_rate(self):
+        if not self.start_time:
+            return 0.0
+        elapsed = (self.end_time or time.time()) - self.start_time
+        if elapsed <= 0:
+            return 0.0
+        return self.attempted / elapsed
@@ -0,0 +1,162 @@
+
+from logger import Log
+from threading import Thread, Lock, Event
+from collections import defaultdict
+import threading
+import cProfile
+import pstats
+import sys
+import os
+
+LOG = Log(__name__)
+
+PROFILERS = ['sampling', 'cprofile']
+
+def thread_role(name):
+    """
+    Harness threads are named <role> or <role>-<detail>, e.g. poster-3
+    """
+    if name == 'MainThread':
+        return 'main'
+    if name.startswith('Thread-'):
+        return 'other'
+    return name.split('-')[0]
+
+def _frame_name(code):
+    return '{0} ({1}:{2})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+"""
+Class to profile the harness threads grouped by role (poster, consumer,
+analyzer, ...), to find whether HTTP, JSON parsing, kombu or the harness'
+own bookkeeping limits it. The sampling mode records the stacks of all
+threads every interval from one extra thread, including time blocked on I/O
+and locks, and writes <role>.collapsed files for flame graph tools. The
+cprofile mode runs a cProfile profiler in every thread started after start()
+and writes <role>.pstats files; it is exact but slows the harness down.
+:param path: output directory
+:param mode: optional 'sampling' or 'cprofile', default sampling
+:param interval: optional seconds between stack samples, default 0.01
+"""
+class ThreadProfiler(object):
+    def __init__(self, **kwargs):
+        self.__path = kwargs.get('path')
+        self.__mode = kwargs.get('mode') or 'sampling'
+        self.__interval = kwargs.get('interval', 0.01)
+        if self.__path is None:
+            raise TypeError('expected path parameter')
+        if self.__mode not in PROFILERS:
+            raise ValueError('unknown profiler {0}'.format(self.__mode))
+        if not self.__interval > 0:
+            raise ValueError('sampling interval must be positive')
+        self.__lock = Lock()
+        self.__stop = Event()
+        self.__thread = None
+        self.__roles = {}
+        self.__profiles = []
+        self.__stacks = defaultdict(lambda: defaultdict(int))
+        self.samples = 0
+
+    def start(self):
+        if self.__mode == 'cprofile':
+            threading.setprofile(self.__hook)
+        else:
+            self.__stop.clear()
+            self.__thread = Thread(target=self.__sample, name='profiler')
+            self.__thread.daemon = True
+            self.__thread.start()
+
+    def stop(self):
+        threading.setprofile(None)
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+
+    def __hook(self, frame, event, arg):
+        # installed by threading in every new thread, hands over to cProfile on the first event
+        sys.setprofile(None)
+        thread = threading.current_thread()
+        profile = cProfile.Profile()
+        with self.__lock:
+            self.__profiles.append([thread, thread_role(thread.name), profile, False])
+        profile.enable()
+
+    def call(self, role, func, *args):
+        """
+        Run func in the calling thread profiled as role, for work done on
+        threads not started by the harness, e.g. the main thread
+        """
+        if self.__mode == 'sampling':
+            ident = threading.current_thread().ident
+            self.__roles[ident] = role
+            try:
+                return func(*args)
+            finally:
+                self.__roles.pop(ident, None)
+        entry = [threading.current_thread(), role, cProfile.Profile(), False]
+        with self.__lock:
+            self.__profiles.append(entry)
+        entry[2].enable()
+        try:
+            return func(*args)
+        finally:
+            entry[2].disable()
+            entry[3] = True
+
+    def __sample(self):
+        own = threading.current_thread().ident
+        while not self.__stop.wait(self.__interval):
+            names = dict((thread.ident, thread.name) for thread in threading.enumerate())
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                role = self.__roles.get(ident) or thread_role(names.get(ident, 'Thread-'))
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                self.__stacks[role][';'.join(reversed(stack))] += 1
+            self.samples += 1
+
+    def __write_pstats(self):
+        written = []
+        by_role = defaultdict(list)
+        skipped = 0
+        with self.__lock:
+            for thread, role, profile, done in self.__profiles:
+                # a profiler still enabled in a live thread cannot be read safely from this one
+                if done or not thread.is_alive():
+                    by_role[role].append(profile)
+                else:
+                    skipped += 1
+        if skipped:
+            LOG.warning('{0} threads were still running and are left out of the profile'.format(skipped))
+        for role, profiles in sorted(by_role.iteritems()):
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            filename = os.path.join(self.__path, '{0}.pstats'.format(role))
+            stats.dump_stats(filename)
+            written.append(filename)
+        return written
+
+    def __write_collapsed(self):
+        written = []
+        for role, stacks in sorted(self.__stacks.iteritems()):
+            filename = os.path.join(self.__path, '{0}.collapsed'.format(role))
+            with open(filename, 'w') as f:
+                for stack, count in sorted(stacks.iteritems()):
+                    f.write('{0} {1}\n'.format(stack, count))
+            written.append(filename)
+        return written
+
+    def write(self):
+        """
+        Write one file per thread role to the output directory
+        :return: list of the files written
+        """
+        if not os.path.isdir(self.__path):
+            os.makedirs(self.__path)
+        if self.__mode == 'cprofile':
+            return self.__write_pstats()
+        return self.__write_collapsed()
@@ -0,0 +1,84 @@
+
+from logger import Log
+from threading import Thread, Lock, Event
+import heapq
+import os
+import resource
+import sys
+import time
+
+LOG = Log(__name__)
+
+# per-thread rusage is Linux only, and python 2's resource module has no constant for it
+RUSAGE_THREAD = getattr(resource, 'RUSAGE_THREAD', 1 if sys.platform.startswith('linux') else None)
+
+def cpu_seconds():
+    """
+    User + system CPU seconds used by this process and its reaped children
+    """
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+def thread_cpu_seconds():
+    """
+    User + system CPU seconds used by the calling thread, None where unsupported
+    """
+    if RUSAGE_THREAD is None:
+        return None
+    usage = resource.getrusage(RUSAGE_THREAD)
+    return usage.ru_utime + usage.ru_stime
+
+"""
+Class to run periodic callbacks from a single timer thread
+The thread sleeps until the next callback is due instead of spinning, so the
+harness does not compete with RackHD for a core.
+:param name: optional name of the timer thread, default sampler
+"""
+class Sampler(object):
+    def __init__(self, name='sampler'):
+        self.__name = name
+        self.__lock = Lock()
+        self.__jobs = []
+        self.__stop = Event()
+        self.__thread = None
+
+    def every(self, interval, func):
+        if interval <= 0:
+            raise ValueError('sampling interval must be positive')
+        with self.__lock:
+            heapq.heappush(self.__jobs, (time.time() + interval, interval, func))
+
+    def __run(self):
+        while not self.__stop.is_set():
+            with self.__lock:
+                due, interval, func = self.__jobs[0]
+            delay = due - time.time()
+            if delay > 0:
+                self.__stop.wait(delay)
+                continue
+            try:
+                func()
+            except Exception as e:
+                LOG.error('sampler callback {0} failed: {1}'.format(func.__name__, e))
+            with self.__lock:
+                heapq.heappop(self.__jobs)
+                # skip missed ticks rather than firing a burst of late callbacks
+                next_due = due + interval
+                now = time.time()
+                if next_due <= now:
+                    next_due = now + interval
+                heapq.heappush(self.__jobs, (next_due, interval, func))
+
+    def start(self):
+        if not self.__jobs:
+            raise ValueError('no sampler callbacks scheduled')
+        self.__stop.clear()
+        self.__thread = Thread(target=self.__run, name=self.__name)
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def stop(self):
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
@@ -0,0 +1,158 @@
+
+from logger import Log
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+LOG = Log(__name__)
+
+# column name, array typecode / numpy dtype
+COLUMNS = [('sent', 'd'), ('accepted', 'd'), ('finished', 'd'), ('status', 'h'), ('graph', 'H'), ('state', 'B'),
+           ('endpoint', 'H')]
+# columns holding an index into a table of interned names
+INTERNED = ['graph', 'state', 'endpoint']
+NOT_SET = float('nan')
+
+"""
+Class to keep per-workflow bookkeeping in typed column arrays, one slot per
+posted workflow, instead of a Python object per workflow (~30 bytes a slot)
+Uses NumPy when it is installed, which also allows spilling the columns to
+memory-mapped files and vectorized queries; falls back to array.array.
+:param path: optional file prefix, columns are memory-mapped to <path>.<column> (NumPy only)
+:param capacity: optional initial number of slots, default 65536
+"""
+class RecordStore(object):
+    def __init__(self, **kwargs):
+        self.__path = kwargs.get('path')
+        self.__capacity = kwargs.get('capacity', 65536)
+        if self.__path is not None and numpy is None:
+            raise ImportError('NumPy is required to spill the record store to {0}'.format(self.__path))
+        self.size = 0
+        self.names = dict((column, [None]) for column in INTERNED)
+        self.__name_index = dict((column, {None: 0}) for column in INTERNED)
+        self.__columns = {}
+        for name, typecode in COLUMNS:
+            if numpy is None:
+                self.__columns[name] = array(typecode)
+            else:
+                self.__columns[name] = self.__allocate(name, typecode, self.__capacity, None)
+
+    def __allocate(self, name, typecode, capacity, old):
+        fill = NOT_SET if typecode == 'd' else 0
+        if self.__path is None:
+            column = numpy.empty(capacity, dtype=typecode)
+            if old is not None:
+                column[:self.size] = old[:self.size]
+        else:
+            filename = '{0}.{1}'.format(self.__path, name)
+            if old is None:
+                column = numpy.memmap(filename, dtype=typecode, mode='w+', shape=(capacity,))
+            else:
+                # extend the file in place, the filled slots are not copied
+                old.flush()
+                with open(filename, 'r+b') as f:
+                    f.truncate(capacity * numpy.dtype(typecode).itemsize)
+                column = numpy.memmap(filename, dtype=typecode, mode='r+', shape=(capacity,))
+        column[self.size:] = fill
+        return column
+
+    def __grow(self):
+        self.__capacity *= 2
+        for name, typecode in COLUMNS:
+            self.__columns[name] = self.__allocate(name, typecode, self.__capacity, self.__columns[name])
+
+    def intern(self, column, name):
+        index = self.__name_index[column].get(name)
+        if index is None:
+            index = self.__name_index[column][name] = len(self.names[column])
+            self.names[column].append(name)
+        return index
+
+    def append(self, sent, status, graph=None, accepted=None, endpoint=None):
+        slot = self.size
+        columns = self.__columns
+        values = {'sent': sent, 'accepted': NOT_SET if accepted is None else accepted,
+                  'finished': NOT_SET, 'status': status or 0, 'graph': self.intern('graph', graph), 'state': 0,
+                  'endpoint': self.intern('endpoint', endpoint)}
+        if numpy is None:
+            for name, typecode in COLUMNS:
+                columns[name].append(values[name])
+        else:
+            if slot >= self.__capacity:
+                self.__grow()
+                columns = self.__columns
+            for name, typecode in COLUMNS:
+                columns[name][slot] = values[name]
+        self.size += 1
+        return slot
+
+    def finish(self, slot, finished, state=None):
+        self.__columns['finished'][slot] = finished
+        self.__columns['state'][slot] = self.intern('state', state)
+
+    def get(self, slot, column):
+        value = self.__columns[column][slot]
+        if numpy is not None:
+            # plain Python values, callers compare with type(x) == float
+            value = value.item()
+        if column in INTERNED:
+            return self.names[column][value]
+        if column in ['sent', 'accepted', 'finished'] and value != value:
+            return None
+        return value
+
+    def column(self, name):
+        """
+        The filled part of a column, a NumPy view or an array.array
+        """
+        return self.__columns[name][:self.size]
+
+    def query(self, start=None, end=None):
+        """
+        Summarize the workflows posted in [start, end), vectorized with NumPy when available
+        :return: dict of posted and finished counts, latencies of the finished
+                 workflows and the first/last finish timestamps
+        """
+        sent = self.column('sent')
+        finished = self.column('finished')
+        if numpy is not None:
+            mask = numpy.ones(self.size, dtype=bool)
+            if start is not None:
+                mask &= sent >= start
+            if end is not None:
+                mask &= sent < end
+            done = mask & ~numpy.isnan(finished)
+            latencies = finished[done] - sent[done]
+            finishes = finished[done]
+            return {
+                'posted': int(mask.sum()),
+                'finished': int(done.sum()),
+                'latencies': latencies,
+                'first_finish': float(finishes.min()) if len(finishes) else None,
+                'last_finish': float(finishes.max()) if len(finishes) else None
+            }
+        posted = 0
+        latencies = []
+        finishes = []
+        for n in xrange(self.size):
+            if (start is not None and sent[n] < start) or (end is not None and sent[n] >= end):
+                continue
+            posted += 1
+            if finished[n] == finished[n]:
+                latencies.append(finished[n] - sent[n])
+                finishes.append(finished[n])
+        return {
+            'posted': posted,
+            'finished': len(latencies),
+            'latencies': latencies,
+            'first_finish': min(finishes) if finishes else None,
+            'last_finish': max(finishes) if finishes else None
+        }
+
+    def flush(self):
+        if self.__path is not None:
+            for column in self.__columns.itervalues():
+                column.flush()
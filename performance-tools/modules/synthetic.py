@@ -0,0 +1,82 @@
+
+from config.amqp import *
+from logger import Log
+from sampler import thread_cpu_seconds
+from kombu import BrokerConnection, Producer
+import time
+import uuid
+
+LOG = Log(__name__)
+
+SYNTHETIC_GRAPH = 'Graph.synthetic'
+
+"""
+Class to stand in for RackHD in a harness self-benchmark: every scheduled
+workflow is registered with the tracker and its graph.finished.<id> event is
+published right away, so only the event path (broker delivery, AMQPWorker,
+handle_graph_finish and the tracker) is measured. It has the scheduling
+interface of WorkflowPoster, so the capacity finder can drive it.
+:param tracker: WorkflowTracker the synthetic workflows are registered with
+:param amqp_url: optional AMQP URL to publish to, defaults from config/amqp.py
+"""
+class SyntheticPublisher(object):
+    def __init__(self, **kwargs):
+        self.__tracker = kwargs.get('tracker')
+        self.__amqp_url = kwargs.get('amqp_url',AMQP_URL)
+        if self.__tracker is None:
+            raise TypeError('expected tracker parameter')
+        self.__connection = BrokerConnection(self.__amqp_url)
+        self.__producer = Producer(self.__connection.channel(), exchange=EXCHANGE_EVENT, serializer='json')
+        self.attempted = 0
+        self.max_lag = None
+        self.cpu = 0.0
+        self.start_time = 0
+        self.end_time = 0
+
+    def publish(self, intended):
+        lag = time.time() - intended
+        if self.max_lag is None or lag > self.max_lag:
+            self.max_lag = lag
+        graph_id = str(uuid.uuid4())
+        self.__tracker.add_post(graph_id, intended, 201, SYNTHETIC_GRAPH, time.time())
+        self.__producer.publish({'graphId': graph_id, 'status': 'succeeded'},
+                                routing_key='graph.finished.{0}'.format(graph_id))
+
+    def run_schedule(self, offsets):
+        """
+        Publish one event per offset at its wall-clock deadline, back to back while behind
+        """
+        cpu = thread_cpu_seconds()
+        self.attempted = 0
+        self.max_lag = None
+        self.start_time = time.time()
+        self.end_time = 0
+        for offset in offsets:
+            if isinstance(offset, tuple):
+                offset = offset[0]
+            deadline = self.start_time + offset
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            self.attempted += 1
+            self.publish(deadline)
+        self.end_time = time.time()
+        if cpu is not None:
+            self.cpu += thread_cpu_seconds() - cpu
+
+    def post_window(self):
+        return self.start_time, self.end_time
+
+    def posting_done(self):
+        return bool(self.start_time and self.end_time)
+
+    def post_rate(self):
+        if not self.start_time:
+            return 0.0
+        elapsed = (self.end_time or time.time()) - self.start_time
+        if elapsed <= 0:
+            return 0.0
+        return self.attempted / elapsed
+
+    def close(self):
+        self.__connection.release()
@@ -0,0 +1,118 @@
+
+from logger import Log
+from workload import GraphSpec
+from threading import Lock
+from json import dumps, loads
+from datetime import datetime
+from urlparse import urlparse, parse_qs
+import calendar
+import re
+
+LOG = Log(__name__)
+
+# timestamp formats found in API access logs: ISO 8601 and common log format
+ISO_TIMESTAMP = re.compile(r'(\d{4}-\d{2}-\d{2})[T ](\d{2}:\d{2}:\d{2})(\.\d+)?')
+CLF_TIMESTAMP = re.compile(r'\[(\d{2}/\w{3}/\d{4}:\d{2}:\d{2}:\d{2})')
+WORKFLOW_POST = re.compile(r'POST\s+(\S*/workflows(?:\?\S*)?)(?:\s|$)')
+NODE_PATH = re.compile(r'/nodes/([^/]+)/workflows')
+
+"""
+Class to record the workflow arrivals of a harness run as a JSONL trace,
+one {"timestamp", "graph", "options", "body", "node"} entry per posted workflow
+:param path: output trace file
+"""
+class TraceRecorder(object):
+    def __init__(self, path):
+        self.__lock = Lock()
+        self.__file = open(path, 'w')
+        self.recorded = 0
+
+    def record(self, timestamp, graph, path, data=None):
+        entry = {'timestamp': timestamp, 'graph': graph}
+        node = NODE_PATH.search(path)
+        if node:
+            entry['node'] = node.group(1)
+        if data is not None:
+            body = loads(data)
+            if isinstance(body, dict) and set(body) <= set(['name', 'options']):
+                entry['options'] = body.get('options')
+            else:
+                entry['body'] = body
+        line = dumps(entry, sort_keys=True, separators=(',', ':')) + '\n'
+        with self.__lock:
+            self.__file.write(line)
+            self.recorded += 1
+
+    def close(self):
+        with self.__lock:
+            self.__file.close()
+
+def _log_timestamp(line):
+    match = ISO_TIMESTAMP.search(line)
+    if match:
+        when = datetime.strptime(match.group(1) + ' ' + match.group(2), '%Y-%m-%d %H:%M:%S')
+        return calendar.timegm(when.timetuple()) + float(match.group(3) or 0)
+    match = CLF_TIMESTAMP.search(line)
+    if match:
+        when = datetime.strptime(match.group(1), '%d/%b/%Y:%H:%M:%S')
+        return calendar.timegm(when.timetuple())
+    return None
+
+def parse_access_log(lines):
+    """
+    Extract workflow arrivals from RackHD API access log lines: POST requests to
+    .../workflows?name=<graph> or .../nodes/<id>/workflows?name=<graph>. Request
+    bodies are not logged, so entries carry no options.
+    """
+    entries = []
+    skipped = 0
+    for line in lines:
+        post = WORKFLOW_POST.search(line)
+        if not post:
+            continue
+        timestamp = _log_timestamp(line)
+        url = urlparse(post.group(1))
+        name = parse_qs(url.query).get('name')
+        if timestamp is None or not name:
+            skipped += 1
+            continue
+        entry = {'timestamp': timestamp, 'graph': name[0]}
+        node = NODE_PATH.search(url.path)
+        if node:
+            entry['node'] = node.group(1)
+        entries.append(entry)
+    if skipped:
+        LOG.warning('skipped {0} workflow POSTs without a timestamp or graph name'.format(skipped))
+    return entries
+
+def load_trace(path):
+    """
+    Load a JSONL trace written by TraceRecorder, or a RackHD API access log,
+    sorted by arrival time
+    """
+    with open(path) as f:
+        lines = f.readlines()
+    try:
+        entries = [loads(line) for line in lines if line.strip()]
+    except ValueError:
+        entries = parse_access_log(lines)
+    for entry in entries:
+        if not isinstance(entry, dict) or 'timestamp' not in entry or not entry.get('graph'):
+            raise ValueError('trace entry without timestamp and graph in {0}: {1}'.format(path, entry))
+    if not entries:
+        raise ValueError('no workflow arrivals in {0}'.format(path))
+    entries.sort(key=lambda entry: entry['timestamp'])
+    return entries
+
+def replay_schedule(entries, speed=1.0):
+    """
+    Generate (offset, GraphSpec) pairs for WorkflowPoster.run_schedule that keep
+    the trace's inter-arrival times, compressed by speed (2.0 replays twice as fast)
+    """
+    if speed <= 0:
+        raise ValueError('replay speed must be positive')
+    start = entries[0]['timestamp']
+    for entry in entries:
+        graph = GraphSpec(name=entry['graph'], options=entry.get('options'), body=entry.get('body'),
+                          nodes=[entry['node']] if entry.get('node') else None)
+        yield (entry['timestamp'] - start) / speed, graph
@@ -0,0 +1,252 @@
+
+from logger import Log
+from histogram import LatencyHistogram
+from store import RecordStore
+from threading import Lock, Condition
+from collections import deque
+import heapq
+import time
+
+LOG = Log(__name__)
+
+"""
+Class to hold a view of a single posted workflow, handed to listeners
+:param graph_id: the RackHD graph instance id
+:param sent: timestamp the workflow POST was sent
+:param status: HTTP status of the workflow POST
+:param graph: optional name of the posted graph
+:param accepted: optional timestamp the POST response was received
+:param endpoint: optional API endpoint the workflow was posted to
+"""
+class WorkflowRecord(object):
+    __slots__ = ('graph_id', 'sent', 'finished', 'status', 'graph', 'accepted', 'endpoint')
+
+    def __init__(self, graph_id, sent, status, graph=None, accepted=None, endpoint=None):
+        self.graph_id = graph_id
+        self.sent = sent
+        self.finished = None
+        self.status = status
+        self.graph = graph
+        self.accepted = accepted
+        self.endpoint = endpoint
+
+    def latency(self):
+        if self.finished is None:
+            return None
+        return self.finished - self.sent
+
+"""
+Class to hold the counters and latency histogram of one graph name or endpoint
+"""
+class GraphStats(object):
+    def __init__(self):
+        self.posted = 0
+        self.finished = 0
+        self.dropped = 0
+        self.lost = 0
+        self.latency = LatencyHistogram()
+
+"""
+Class to track in-flight workflows keyed by graph id
+Both the poster and the AMQP consumer update the tracker, so every lookup is
+a dict access instead of a scan of the posted workflows. Completions that
+arrive before the POST response has been recorded are buffered and matched
+once the poster records the graph id; those no POST matched within a grace
+period, duplicates or graphs not posted by this run, are dropped and counted
+as unmatched. Completion latencies are recorded
+into a cumulative and a per-window histogram, and per graph name and API endpoint.
+Per-workflow timestamps live in a RecordStore; graph ids are only kept while
+their workflow is in flight. With a timeout, every posted workflow also gets
+a deadline in a heap, so expiring lost workflows costs O(log n) per workflow
+instead of a scan of everything in flight.
+:param store: optional RecordStore, default an in-memory store
+:param timeout: optional seconds after its send time a workflow is considered lost, default never
+:param early_grace: optional seconds a buffered completion waits for its POST, default 60.0
+"""
+class WorkflowTracker(object):
+    def __init__(self, **kwargs):
+        self.__lock = Lock()
+        self.__changed = Condition(self.__lock)
+        self.store = kwargs.get('store') or RecordStore()
+        self.__timeout = kwargs.get('timeout')
+        self.__early_grace = kwargs.get('early_grace', 60.0)
+        self.__in_flight = {}
+        self.__early = {}
+        self.__early_order = deque()
+        self.__deadlines = []
+        self.__lost = set()
+        self.posted = 0
+        self.finished = 0
+        self.dropped = 0
+        self.lost = 0
+        self.late = 0
+        self.unmatched = 0
+        self.max_wait = 0.0
+        self.latency = LatencyHistogram()
+        self.__window = LatencyHistogram()
+        self.graphs = {}
+        self.endpoints = {}
+        self.__listeners = []
+
+    def add_listener(self, func):
+        """
+        Call func(record) for every completed workflow, with the tracker lock held
+        """
+        self.__listeners.append(func)
+
+    def __stats(self, table, key):
+        stats = table.get(key)
+        if stats is None:
+            stats = table[key] = GraphStats()
+        return stats
+
+    def __record(self, graph_id, slot):
+        store = self.store
+        record = WorkflowRecord(graph_id, store.get(slot, 'sent'), store.get(slot, 'status'),
+                                store.get(slot, 'graph'), store.get(slot, 'accepted'), store.get(slot, 'endpoint'))
+        record.finished = store.get(slot, 'finished')
+        return record
+
+    def add_post(self, graph_id, sent, status, graph=None, accepted=None, endpoint=None):
+        with self.__lock:
+            slot = self.store.append(sent, status, graph, accepted, endpoint)
+            self.__in_flight[graph_id] = slot
+            self.posted += 1
+            self.__stats(self.graphs, graph).posted += 1
+            self.__stats(self.endpoints, endpoint).posted += 1
+            self.__changed.notify_all()
+            early = self.__early.pop(graph_id, None)
+            if early is not None:
+                LOG.debug('matched early completion for {0}', graph_id)
+                return self.__complete(graph_id, *early[:2])
+            if self.__timeout is not None:
+                heapq.heappush(self.__deadlines, (sent + self.__timeout, slot, graph_id))
+            return self.__record(graph_id, slot)
+
+    def add_drop(self, sent, status, graph=None, endpoint=None):
+        with self.__lock:
+            self.dropped += 1
+            self.__stats(self.graphs, graph).dropped += 1
+            self.__stats(self.endpoints, endpoint).dropped += 1
+            self.__changed.notify_all()
+
+    def add_finish(self, graph_id, finished, status=None):
+        with self.__lock:
+            if graph_id not in self.__in_flight:
+                if graph_id in self.__lost:
+                    self.__lost.discard(graph_id)
+                    self.late += 1
+                    return None
+                # not posted yet, or a duplicate of an already finished graph
+                now = time.time()
+                self.__purge_early(now - self.__early_grace)
+                self.__early_order.append((now, graph_id))
+                self.__early[graph_id] = (finished, status, now)
+                return None
+            return self.__complete(graph_id, finished, status)
+
+    def __purge_early(self, before):
+        # buffered in arrival order, entries matched since are skipped as they surface
+        while self.__early_order and self.__early_order[0][0] <= before:
+            received, graph_id = self.__early_order.popleft()
+            early = self.__early.get(graph_id)
+            if early is None or early[2] != received:
+                continue
+            del self.__early[graph_id]
+            self.unmatched += 1
+            LOG.warning('unmatched completion for {0}, a duplicate or not posted by this run'.format(graph_id))
+
+    def purge_early(self, before=None):
+        """
+        Count buffered completions received before the given time, default all, as unmatched
+        """
+        with self.__lock:
+            self.__purge_early(float('inf') if before is None else before)
+
+    def __complete(self, graph_id, finished, status):
+        slot = self.__in_flight.pop(graph_id)
+        self.store.finish(slot, finished, status)
+        record = self.__record(graph_id, slot)
+        self.finished += 1
+        wait = record.latency()
+        if wait > self.max_wait:
+            self.max_wait = wait
+        self.latency.record(wait)
+        self.__window.record(wait)
+        for stats in [self.__stats(self.graphs, record.graph), self.__stats(self.endpoints, record.endpoint)]:
+            stats.finished += 1
+            stats.latency.record(wait)
+        for listener in self.__listeners:
+            listener(record)
+        self.__changed.notify_all()
+        return record
+
+    def expire(self, now):
+        """
+        Mark workflows whose deadline passed as lost, they no longer count as in flight
+        Heap entries of workflows that finished in time are discarded as they surface.
+        :return: list of (graph_id, sent) of the newly lost workflows
+        """
+        expired = []
+        with self.__lock:
+            while self.__deadlines and self.__deadlines[0][0] <= now:
+                deadline, slot, graph_id = heapq.heappop(self.__deadlines)
+                if self.__in_flight.get(graph_id) != slot:
+                    continue
+                del self.__in_flight[graph_id]
+                self.store.finish(slot, float('nan'), 'lost')
+                self.__lost.add(graph_id)
+                self.lost += 1
+                self.__stats(self.graphs, self.store.get(slot, 'graph')).lost += 1
+                self.__stats(self.endpoints, self.store.get(slot, 'endpoint')).lost += 1
+                expired.append((graph_id, self.store.get(slot, 'sent')))
+            if expired:
+                self.__changed.notify_all()
+            self.__purge_early(now - self.__early_grace)
+        return expired
+
+    def wait_until(self, predicate, interval=None):
+        """
+        Block until predicate() holds, re-checking whenever a workflow is posted,
+        dropped or finished, and every interval seconds when given (for predicates
+        on state outside the tracker). The predicate runs with the tracker lock held.
+        """
+        with self.__changed:
+            while not predicate():
+                self.__changed.wait(interval)
+
+    def swap_window(self):
+        """
+        Close the current sampling window and return its latency histogram
+        """
+        with self.__lock:
+            window = self.__window
+            self.__window = LatencyHistogram()
+            return window
+
+    def latency_summary(self):
+        with self.__lock:
+            return self.latency.summary()
+
+    def query(self, start=None, end=None):
+        """
+        Vectorized summary of the workflows posted in [start, end), see RecordStore.query
+        """
+        with self.__lock:
+            return self.store.query(start, end)
+
+    def __summaries(self, table):
+        with self.__lock:
+            return dict((key, {'posted': stats.posted, 'finished': stats.finished,
+                               'dropped': stats.dropped, 'lost': stats.lost,
+                               'latency': stats.latency.summary()})
+                        for key, stats in table.iteritems())
+
+    def graph_summaries(self):
+        return self.__summaries(self.graphs)
+
+    def endpoint_summaries(self):
+        return self.__summaries(self.endpoints)
+
+    def in_flight(self):
+        return self.posted - self.finished - self.lost
@@ -0,0 +1,164 @@
+
+from histogram import format_value
+import math
+import os
+
+# (name, summary keys, label) of the metrics summarized across trials
+TRIAL_METRICS = [
+    ('throughput', ('throughput',), 'throughput (wf/s)'),
+    ('post_rate', ('post_rate',), 'post rate (wf/s)'),
+    ('p50', ('latency', 'p50'), 'p50 (sec)'),
+    ('p90', ('latency', 'p90'), 'p90 (sec)'),
+    ('p99', ('latency', 'p99'), 'p99 (sec)'),
+    ('p99.9', ('latency', 'p99.9'), 'p99.9 (sec)'),
+    ('mean', ('latency', 'mean'), 'mean (sec)')
+]
+
+# two-sided 95% critical values of Student's t distribution for 1..30 degrees of freedom
+T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+        2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+        2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+Z_95 = 1.960
+
+def t_critical(df):
+    if df >= len(T_95) + 1:
+        return Z_95
+    # rounding the degrees of freedom down keeps the interval conservative
+    return T_95[max(int(df), 1) - 1]
+
+def _median(ordered):
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+def _median_ci(ordered):
+    """
+    Distribution-free 95% interval for the median: the order statistics
+    x(k) and x(n-k+1) with P(Binomial(n, 1/2) < k) <= 0.025, None below 6 values
+    """
+    n = len(ordered)
+    k = 0
+    cumulative = 0.0
+    while True:
+        p = math.exp(math.lgamma(n + 1) - math.lgamma(k + 1) - math.lgamma(n - k + 1)) / 2.0 ** n
+        if cumulative + p > 0.025:
+            break
+        cumulative += p
+        k += 1
+    if k == 0:
+        return None
+    return [ordered[k - 1], ordered[n - k]]
+
+def summarize(values):
+    """
+    :return: dict of n, mean, stddev (sample), ci95 (half-width of the 95% interval of the mean),
+             median, median_ci ([low, high] or None), cv (stddev / mean) and the values
+    """
+    values = [float(value) for value in values if value is not None]
+    n = len(values)
+    if not n:
+        return None
+    mean = sum(values) / n
+    stddev = math.sqrt(sum((value - mean) ** 2 for value in values) / (n - 1)) if n > 1 else None
+    ordered = sorted(values)
+    return {
+        'n': n,
+        'mean': mean,
+        'stddev': stddev,
+        'ci95': t_critical(n - 1) * stddev / math.sqrt(n) if stddev is not None else None,
+        'median': _median(ordered),
+        'median_ci': _median_ci(ordered),
+        'cv': stddev / mean if stddev is not None and mean else None,
+        'values': values
+    }
+
+def lookup(result, keys):
+    """
+    Value at a key path of a nested run summary, e.g. ('latency', 'p99'), None when missing
+    """
+    for key in keys:
+        if not isinstance(result, dict):
+            return None
+        result = result.get(key)
+    return result
+
+def summarize_trials(results):
+    """
+    Summarize per-trial run summaries (see build_result), their steady_state section when present
+    :return: dict of metric name to summarize() output
+    """
+    stats = {}
+    for name, keys, label in TRIAL_METRICS:
+        values = []
+        for result in results:
+            if isinstance(result.get('steady_state'), dict):
+                result = result['steady_state']
+            values.append(lookup(result, keys))
+        stats[name] = summarize(values)
+    return stats
+
+def significant_difference(old, new):
+    """
+    Welch's t-test at the 95% level on two summarize() outputs
+    :return: True or False, None when either side has fewer than 2 values
+    """
+    if not old or not new or old['stddev'] is None or new['stddev'] is None:
+        return None
+    old_var = old['stddev'] ** 2 / old['n']
+    new_var = new['stddev'] ** 2 / new['n']
+    if old_var + new_var == 0:
+        return old['mean'] != new['mean']
+    t = abs(new['mean'] - old['mean']) / math.sqrt(old_var + new_var)
+    df = (old_var + new_var) ** 2 / (old_var ** 2 / (old['n'] - 1) + new_var ** 2 / (new['n'] - 1))
+    return t > t_critical(df)
+
+def trial_path(path, index):
+    """
+    Per-trial variant of an output path: series.csv -> series.trial2.csv, prof/ -> prof.trial2
+    """
+    # a directory given with a trailing separator gets a sibling, not a hidden subdirectory
+    root, ext = os.path.splitext(path.rstrip(os.sep) or path)
+    return '{0}.trial{1}{2}'.format(root, index, ext)
+
+def trial_arguments(argv, index, drop, per_trial):
+    """
+    Command line of one trial
+    :param argv: command line arguments of the repeated run
+    :param drop: options left out, all taking a value
+    :param per_trial: options whose value is replaced by its trial_path
+    Options may be given as '--name value' or '--name=value'.
+    """
+    out = []
+    args = iter(argv)
+    for arg in args:
+        name, equals, value = arg.partition('=')
+        if name in drop:
+            if not equals:
+                next(args, None)
+            continue
+        if name in per_trial:
+            if not equals:
+                value = next(args, '')
+            out.extend([name, trial_path(value, index)])
+            continue
+        out.append(arg)
+    return out
+
+def format_trials(stats):
+    lines = ['%-18s %10s %10s %10s %21s %10s %7s' %
+             ('metric', 'mean', '+/-95%', 'median', 'median 95% CI', 'stddev', 'cv')]
+    for name, keys, label in TRIAL_METRICS:
+        summary = stats.get(name)
+        if summary is None:
+            lines.append('%-18s %10s' % (label, '-'))
+            continue
+        median_ci = summary['median_ci']
+        lines.append('%-18s %10s %10s %10s %21s %10s %7s' %
+                     (label, format_value(summary['mean']), format_value(summary['ci95']),
+                      format_value(summary['median']),
+                      '-' if median_ci is None else '%s - %s' % (format_value(median_ci[0]),
+                                                                 format_value(median_ci[1])),
+                      format_value(summary['stddev']),
+                      '-' if summary['cv'] is None else '%.1f%%' % (summary['cv'] * 100)))
+    return '\n'.join(lines)
@@ -1,11 +1,17 @@
 
 from logger import Log
-from threading import Thread
-from datetime import datetime, timedelta
-import time
+from threading import Thread, Condition
+import os
 
 LOG = Log(__name__)
 
+try:
+    from time import monotonic
+except ImportError:
+    # python 2: elapsed real time of times(2), monotonic at clock tick resolution
+    def monotonic():
+        return os.times()[4]
+
 """
 Class to abstract threaded worker subtasks
 :param id: node identifier
@@ -22,6 +28,8 @@ class WorkerThread(object):
 
 """
 Class to construct a threaded worker
+Subtask threads signal the supervisor when they return, so it wakes up on
+completion or at the nearest timeout instead of polling.
 :param func: thread target function
 :param tasks: list of subtasks (WorkerThread)
 :param daemon: option to run task thread daemonized
@@ -31,45 +39,70 @@ class WorkerTasks(object):
         self.__func = kwargs.get('func')
         self.__tasks = kwargs.get('tasks')
         self.__daemon = kwargs.get('daemon',True)
+        self.__changed = Condition()
         if not isinstance(self.__tasks, list):
             raise TypeError('expected thread task list')
         if not hasattr(self.__func, '__call__'):
             raise TypeError('expected callable function')
 
+    def __target(self, task):
+        try:
+            self.__func(task.worker, task.id)
+        finally:
+            with self.__changed:
+                task.running = False
+                self.__changed.notify_all()
+
     def __wait(self, timeout_sec):
         while len(self.__tasks):
-            for task in self.__tasks:
-                elapsed_time = int(time.mktime(datetime.now().timetuple()) - task.start_time)
-                if timeout_sec != -1 and elapsed_time >= timeout_sec:
-                    LOG.warning('subtask timeout after {0} seconds, (id={1}), stopping..' \
-                        .format(elapsed_time,task.id))
-                    task.worker.stop()
-                    task.running = False
-                    task.timeout = True
-                if not task.running:
-                    self.__stop(task)
-            time.sleep(1)
+            finished = []
+            with self.__changed:
+                now = monotonic()
+                wait = None
+                for task in self.__tasks:
+                    if not task.running:
+                        finished.append(task)
+                        continue
+                    if timeout_sec == -1:
+                        continue
+                    remaining = task.start_time + timeout_sec - now
+                    if remaining <= 0:
+                        LOG.warning('subtask timeout after {0:.2f} seconds, (id={1}), stopping..' \
+                            .format(now - task.start_time,task.id))
+                        task.worker.stop()
+                        task.running = False
+                        task.timeout = True
+                        finished.append(task)
+                    elif wait is None or remaining < wait:
+                        wait = remaining
+                if not finished:
+                    self.__changed.wait(wait)
+            # join outside the lock, a returning thread needs it to signal
+            for task in finished:
+                self.__stop(task)
 
     def __stop(self, task):
         LOG.info('stopping subtask for {0}'.format(task.id))
         task.thread.join()
         try:
             self.__tasks.remove(task)
-        except IndexError:
-            LOG.error('index error while removing subtask from list!')
+        except ValueError:
+            LOG.error('subtask {0} already removed from list!'.format(task.id))
 
     def __run(self):
         for task in self.__tasks:
-	        task.thread = Thread(target=self.__func, \
-                                     args=(task.worker,task.id,))
-	        task.thread.daemon = self.__daemon
-	        task.start_time = time.mktime(datetime.now().timetuple())
-	        task.running = True
-	        task.thread.start()
+            task.thread = Thread(target=self.__target, args=(task,))
+            task.thread.daemon = self.__daemon
+            task.start_time = monotonic()
+            task.running = True
+            task.thread.start()
 
     def run(self):
         self.__run()
 
     def wait_for_completion(self, timeout_sec=300):
+        """
+        Wait for all subtasks to return, stopping the ones still running after
+        timeout_sec (fractional seconds, -1 waits forever)
+        """
         self.__wait(timeout_sec)
-
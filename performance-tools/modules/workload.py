@@ -0,0 +1,96 @@
+
+from threading import Lock
+from bisect import bisect_right
+from itertools import cycle
+from json import dumps, load
+import random
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+DEFAULT_GRAPH = 'Graph.noop-example'
+
+"""
+Class to describe one graph of a workload mix
+:param name: the graph injectableName, e.g. Graph.noop-example
+:param weight: optional relative weight within the mix, default 1
+:param options: optional graph options, posted as {"name": ..., "options": ...}
+:param body: optional raw POST body, overrides options
+:param nodes: optional list of node ids, graphs are posted to /nodes/<id>/workflows round-robin
+"""
+class GraphSpec(object):
+    def __init__(self, **kwargs):
+        self.name = kwargs.get('name')
+        self.weight = kwargs.get('weight', 1)
+        self.options = kwargs.get('options')
+        self.body = kwargs.get('body')
+        self.nodes = kwargs.get('nodes') or []
+        if not self.name:
+            raise ValueError('graph entry without a name')
+        if self.weight <= 0:
+            raise ValueError('graph {0} weight must be positive'.format(self.name))
+        self.__nodes = cycle(self.nodes) if self.nodes else None
+        self.__lock = Lock()
+
+    def request(self):
+        """
+        Return the (path, data) of the next workflow POST for this graph
+        """
+        if self.__nodes is not None:
+            with self.__lock:
+                node = next(self.__nodes)
+            path = '/nodes/{0}/workflows?name={1}'.format(node, self.name)
+        else:
+            path = '/workflows?name={0}'.format(self.name)
+        if self.body is not None:
+            return path, dumps(self.body)
+        if self.options is not None:
+            return path, dumps({'name': self.name, 'options': self.options})
+        return path, None
+
+"""
+Class to sample graphs from a weighted workload mix
+:param graphs: list of GraphSpec
+"""
+class Workload(object):
+    def __init__(self, graphs):
+        if not graphs:
+            raise ValueError('workload has no graphs')
+        self.graphs = graphs
+        self.__cumulative = []
+        total = 0
+        for graph in graphs:
+            total += graph.weight
+            self.__cumulative.append(total)
+        self.__total = total
+
+    def sample(self):
+        if len(self.graphs) == 1:
+            return self.graphs[0]
+        index = bisect_right(self.__cumulative, random.random() * self.__total)
+        return self.graphs[min(index, len(self.graphs) - 1)]
+
+    @staticmethod
+    def default():
+        return Workload([GraphSpec(name=DEFAULT_GRAPH)])
+
+    @staticmethod
+    def load(path):
+        """
+        Load a workload file, YAML if the file ends with .yml/.yaml, JSON otherwise:
+        {"graphs": [{"name": "Graph.noop-example", "weight": 3},
+                    {"name": "Graph.Poller", "weight": 1, "nodes": ["<node id>"], "options": {...}}]}
+        """
+        with open(path) as f:
+            if path.endswith(('.yml', '.yaml')):
+                if yaml is None:
+                    raise ImportError('PyYAML is required to load {0}'.format(path))
+                spec = yaml.safe_load(f)
+            else:
+                spec = load(f)
+        graphs = spec.get('graphs') if isinstance(spec, dict) else spec
+        if not isinstance(graphs, list):
+            raise ValueError('expected a list of graphs in {0}'.format(path))
+        return Workload([GraphSpec(**graph) for graph in graphs])
@@ -1,8 +1,8 @@
-import requests
-import json, time, sys
+import time, sys
 import signal
+import os, subprocess, tempfile, shutil
 from config.amqp import *
-from modules.amqp import AMQPWorker
+from modules.amqp import AMQPWorker, ConsumerGroup, QueueMonitor, purge_queue
 from proboscis.asserts import *
 from threading import Timer,Thread
 from decimal import *
@@ -10,18 +10,52 @@ import textwrap
 import argparse
 import time
 import sys
-from modules.worker import WorkerThread, WorkerTasks
+from modules.tracker import WorkflowTracker
+from modules.store import RecordStore
+from modules.poster import WorkflowPoster, ARRIVALS, arrival_offsets
+from modules.endpoints import EndpointPool, DISPATCH, format_endpoint_table
+from modules.capacity import CapacityFinder, format_capacity_table
+from modules.histogram import LatencyHistogram, format_summary
+from modules.workload import Workload
+from modules.trace import TraceRecorder, load_trace, replay_schedule
+from modules.distributed import Coordinator
+from modules.sampler import Sampler, cpu_seconds
+from modules.synthetic import SyntheticPublisher
+from modules.poller import PollerTracker, fetch_poller_intervals, format_poller_table
+from requests.exceptions import RequestException
+from modules.exporter import SeriesWriter, MetricsFile, SERIES_FIELDS, DEPTH_PREFIX
+from modules.lifecycle import LifecycleTracker, format_breakdown
+from modules.footprint import FootprintMarkers
+from modules.profiler import ThreadProfiler, PROFILERS
+from modules.baseline import save_result, load_result, compare_results, format_comparison
+from modules.trials import summarize_trials, trial_arguments, format_trials
+from itertools import takewhile
 from argparse import RawTextHelpFormatter
 
 throughput= 0.0
 agrigateThroughput = 0.0
 start_time = 0
+start_cpu = 0.0
 done = False
-max_wait = 0.0
-time_to_clear_queue= 1
-consumed_workflows = []
-produced_workflows = []
-dropped_workflows = []
+tracker = WorkflowTracker()
+# sample_function and the live line run on the sampler thread, profiled with the analyzer
+sampler = Sampler(name='analyzer-sampler')
+last_sample_time = 0
+last_finished = 0
+# start of the current series window, advanced on every sample unlike last_sample_time
+window_start = 0
+window_finished = 0
+window_latency = None
+worst_window_latency = None
+series_writer = None
+metrics_file = None
+queue_monitor = None
+lifecycle = None
+trace_recorder = None
+pollers = None
+footprint = None
+profiler = None
+lost_workflows = []
 
 
 def signal_handler(signum,stack):
@@ -32,140 +66,732 @@ def signal_handler(signum,stack):
 signal.signal(signal.SIGINT, signal_handler)
 
 def handle_graph_finish(body, message):
-    global consumed_workflows, produced_workflows, max_wait
-
-    temp_dict = {}
+    finished = time.time()
     routeId = message.delivery_info.get('routing_key').split('graph.finished.')[1]
     assert_not_equal(routeId, None)
-    message.ack()
-    temp_dict['time_stamp']= time.time()
-    temp_dict['graph_id']= routeId
-    consumed_workflows.append(temp_dict)
-    graph_wait = 0
-    for index, item in enumerate(produced_workflows):
-        if item["graph_id"] == routeId:
-            graph_wait =  temp_dict['time_stamp'] - item['time_stamp']
-            break
-    if (max_wait < graph_wait):
-        max_wait = graph_wait
+    status = body.get('status') if isinstance(body, dict) else None
+    tracker.add_finish(routeId, finished, status)
 
 def post_function(TOTAL_WORKFLOWS):
-    global consumed_workflows, produced_workflows, dropped_workflow, start_time
-    start_time = time.time()
-    for n in range(TOTAL_WORKFLOWS):
-        temp_dict= {}
-        r = post('/workflows?name=Graph.noop-example')
-        graphId =  json.loads(r._content)["instanceId"]
-        temp_dict['time_stamp'] = time.time()
-        temp_dict['graph_id'] = graphId
+    if REPLAY is not None:
+        poster.run_schedule(replay_schedule(REPLAY, SPEED))
+    elif RATE:
+        poster.run_rate(TOTAL_WORKFLOWS, RATE, ARRIVAL, DURATION)
+    else:
+        poster.run(TOTAL_WORKFLOWS, DURATION)
 
+def run_capacity_step(rate):
+    if footprint is not None:
+        footprint.mark('rate {0:.2f} wf/s'.format(rate))
+    dropped = tracker.dropped
+    cpu = cpu_seconds()
+    offsets = takewhile(lambda offset: offset < STEP_WINDOW, arrival_offsets(rate, ARRIVAL))
+    poster.run_schedule(offsets)
+    step_start = poster.start_time
+    step = tracker.query(step_start, step_start + STEP_WINDOW)
+    deadline = time.time() + DRAIN_TIMEOUT
+    while time.time() < deadline and step['finished'] < step['posted']:
+        time.sleep(0.1)
+        step = tracker.query(step_start, step_start + STEP_WINDOW)
+    latencies = LatencyHistogram()
+    for latency in step['latencies']:
+        latencies.record(latency)
+    drops = (tracker.dropped - dropped) + step['posted'] - step['finished']
+    attempted = step['posted'] + tracker.dropped - dropped
+    # completions of a step that keeps up span the step window, one that
+    # falls behind keeps completing after it, lowering the achieved rate
+    if step['finished']:
+        span = step['last_finish'] - step['first_finish'] + 1.0 / rate
+    else:
+        span = STEP_WINDOW
+    return {
+        'rate': rate,
+        'throughput': latencies.count / span,
+        'p50': latencies.percentile(50),
+        'p95': latencies.percentile(95),
+        'p99': latencies.percentile(99),
+        'drops': drops,
+        'drop_rate': float(drops) / attempted if attempted else 0.0,
+        'finished': latencies.count,
+        'cpu': cpu_seconds() - cpu,
+        'max_lag': poster.max_lag
+    }
 
-        if (r.status_code != 201):
-            dropped_workflows.append(temp_dict)
-        else:
-            produced_workflows.append(temp_dict)
-
-def print_function(REFRESH_RATE):
-    while 1:
-        if(done == False):
-            cw_length = len(consumed_workflows)
-            pw_length = len(produced_workflows)
-            dw_length = len(dropped_workflows)
-
-            if(type(agrigateThroughput) == float and type(throughput)  == float and type(max_wait) == float):
-                agrigateThroughput1 = "%.2f" % agrigateThroughput
-                throughput1 = "%.2f" % throughput
-                max_wait1 = "%.2f" % max_wait
-                print ("\r PostedWFs:{0} FinishedWFs:{1} DroppedWFs:{2} Tph:{3}wf/s avgTph:{4}wf/s max_wait={5}sec".
-                       format(pw_length, cw_length, dw_length, throughput1, agrigateThroughput1, max_wait1)),
-                sleep_time = 1.0 / REFRESH_RATE
-                time.sleep(sleep_time)
+def run_event_step(rate):
+    # the synthetic publisher shares this process, leave its CPU out of the event path cost
+    publisher_cpu = poster.cpu
+    result = run_capacity_step(rate)
+    result['cpu'] -= poster.cpu - publisher_cpu
+    return result
+
+def capacity_function():
+    global done
+    finder = CapacityFinder(run_step=run_event_step if SELF_BENCHMARK else run_capacity_step, rate_start=RATE_START, rate_step=RATE_STEP,
+                            rate_max=RATE_MAX, resolution=RATE_RESOLUTION,
+                            slo_p99=SLO_P99, slo_drop_rate=SLO_DROP_RATE)
+    knee = finder.run()
+    done = True
+    if SELF_BENCHMARK:
+        print '\nHarness event path (synthetic graph.finished via {0}, rates in events/sec):'.format(AMQP_URL)
+    print '\n' + format_capacity_table(finder.results, knee)
+    amqp_listner_worker.stop()
+
+def print_function():
+    if(done == False):
+        cw_length = tracker.finished
+        pw_length = tracker.posted
+        dw_length = tracker.dropped
+        max_wait = tracker.max_wait
+
+        if(type(agrigateThroughput) == float and type(throughput)  == float and type(max_wait) == float):
+            agrigateThroughput1 = "%.2f" % agrigateThroughput
+            throughput1 = "%.2f" % throughput
+            max_wait1 = "%.2f" % max_wait
+            post_rate1 = "%.2f" % poster.post_rate()
+            latency = tracker.latency_summary()
+            p50 = "%.2f" % (latency['p50'] or 0.0)
+            p99 = "%.2f" % (latency['p99'] or 0.0)
+            window_p99 = "%.2f" % ((window_latency or {}).get('p99') or 0.0)
+            backlog = '-' if consumer.backlog is None else consumer.backlog
+            print ("\r PostedWFs:{0} FinishedWFs:{1} DroppedWFs:{2} Pps:{3}wf/s Tph:{4}wf/s avgTph:{5}wf/s max_wait={6}sec"
+                   " p50={7}sec p99={8}sec winP99={9}sec backlog={10}".
+                   format(pw_length, cw_length, dw_length, post_rate1, throughput1, agrigateThroughput1, max_wait1,
+                          p50, p99, window_p99, backlog)),
+            sys.stdout.flush()
+
+def steady_state_summary():
+    """
+    Summary of the workflows posted after the warm-up and before the cool-down
+    window; those posted inside the excluded windows ran but are left out
+    """
+    start, end = poster.post_window()
+    if DURATION is not None:
+        # a backed up open-loop poster returns after the schedule, its send times stay within it
+        end = min(end, start + DURATION)
+    start += WARMUP
+    end -= COOLDOWN
+    if end <= start:
+        return None
+    window = tracker.query(start, end)
+    latencies = LatencyHistogram()
+    for latency in window['latencies']:
+        latencies.record(latency)
+    return {
+        'start': start,
+        'end': end,
+        'posted': window['posted'],
+        'finished': window['finished'],
+        'unfinished': window['posted'] - window['finished'],
+        'post_rate': window['posted'] / (end - start),
+        'throughput': window['finished'] / (end - start),
+        'latency': latencies.summary()
+    }
+
+def expire_function():
+    for graph_id, sent in tracker.expire(time.time()):
+        lost_workflows.append(graph_id)
+        if CANCEL_LOST:
+            # the cancel DELETEs would hold up the sampler thread
+            workflow_api.cancel_later(graph_id)
+
+def print_summary():
+    print '\nLatency (cumulative):  {0} count={1}'.format(format_summary(tracker.latency_summary()), tracker.finished)
+    if WARMUP or COOLDOWN:
+        steady = steady_state_summary()
+        if steady is None:
+            print 'Steady state: none, the run was shorter than --warmup + --cooldown'
         else:
-            break
+            print 'Steady state ({0:.1f}sec after a {1:g}sec warm-up, {2:g}sec cool-down excluded): posted={3} ' \
+                  'finished={4} unfinished={5} throughput={6:.2f}wf/s'.format(
+                      steady['end'] - steady['start'], WARMUP, COOLDOWN, steady['posted'], steady['finished'],
+                      steady['unfinished'], steady['throughput'])
+            print 'Latency (steady state): {0} count={1}'.format(format_summary(steady['latency']),
+                                                                steady['latency']['count'])
+    graphs = tracker.graph_summaries()
+    if len(graphs) > 1:
+        elapsed = time.time() - start_time
+        for graph, stats in sorted(graphs.iteritems()):
+            print '  {0}: posted={1} finished={2} dropped={3} lost={4} Tph:{5:.2f}wf/s {6}'.format(
+                graph, stats['posted'], stats['finished'], stats['dropped'], stats['lost'],
+                stats['finished'] / elapsed if elapsed > 0 else 0.0, format_summary(stats['latency']))
+    if tracker.lost:
+        print 'Lost workflows (no graph.finished within {0:g}sec): {1}, finished late: {2}{3}'.format(
+            WORKFLOW_TIMEOUT, tracker.lost, tracker.late, ', cancelled: {0}'.format(workflow_api.cancelled) if CANCEL_LOST else '')
+        print '  ' + ' '.join(lost_workflows[:10]) + (' ...' if len(lost_workflows) > 10 else '')
+    if tracker.unmatched:
+        print 'Unmatched completions (duplicates or not posted by this run): {0}'.format(tracker.unmatched)
+    if len(BASE_URLS) > 1:
+        print 'Endpoints ({0} dispatch):'.format(DISPATCH_POLICY)
+        print format_endpoint_table(tracker.endpoint_summaries(), time.time() - start_time)
+    if len(AMQP_URLS) > 1 and PROCESSES == 1:
+        print amqp_listner_worker.format_brokers()
+    if PROCESSES > 1:
+        print consumer.format_workers()
+    if window_latency is not None:
+        print 'Latency (last window): {0} count={1}'.format(format_summary(window_latency), window_latency['count'])
+        print 'Latency (worst window): {0} count={1}'.format(format_summary(worst_window_latency),
+                                                            worst_window_latency['count'])
+    if queue_monitor is not None:
+        print 'Peak broker queue depth: ' + ' '.join('{0}={1}'.format(name, '-' if depth is None else depth)
+                                                     for name, depth in sorted(queue_monitor.peaks.iteritems()))
+    if trace_recorder is not None:
+        print 'Trace: {0} workflow arrivals recorded to {1}'.format(trace_recorder.recorded, args.record_trace)
+    if lifecycle is not None:
+        print 'Latency breakdown ({0} lifecycle events):'.format(lifecycle.events)
+        print format_breakdown(*lifecycle.summaries())
+    if poster.max_lag is not None and not FIND_CAPACITY:
+        print 'Scheduler lag: max={0:.3f}sec behind the open-loop send schedule'.format(poster.max_lag)
+    wall = time.time() - start_time
+    cpu = cpu_seconds() - start_cpu
+    print 'Harness overhead: cpu={0:.2f}sec wall={1:.2f}sec ({2:.1f}% of one core)'.format(
+        cpu, wall, 100.0 * cpu / wall if wall > 0 else 0.0)
 
-def analyze_function(TOTAL_WORKFLOWS, SAMPLING_WINDOW):
-    global consumed_workflows, produced_workflows, dropped_workflows, throughput, agrigateThroughput
-    global start_time, done
-    start_time = time.time()
-    lastTime = time.time()
-    last_consumed_workflows = len(consumed_workflows)
-    while 1:
-        currentTime = time.time()
-        deltaTime = currentTime -lastTime
+def sample_function():
+    global throughput, agrigateThroughput, window_latency, worst_window_latency
+    global last_sample_time, last_finished, window_start, window_finished
+    currentTime = time.time()
+    deltaTime = currentTime - last_sample_time
+    cw_length = tracker.finished
+    deltaWorkflows = cw_length - last_finished
+    windowTime = currentTime - window_start
+    windowWorkflows = cw_length - window_finished
+    window_start = currentTime
+    window_finished = cw_length
+    window = tracker.swap_window().summary()
+    depths = queue_monitor.sample() if queue_monitor is not None else {}
+
+    if(deltaWorkflows > 0):
+        last_sample_time = currentTime
+        throughput =  deltaWorkflows / (deltaTime)
+        window_latency = window
+        if worst_window_latency is None or window_latency['p99'] > worst_window_latency['p99']:
+            worst_window_latency = window_latency
+        last_finished = cw_length
+        agrigateThroughput = cw_length/ (currentTime - start_time)
 
-        cw_length = len(consumed_workflows)
-        pw_length = len(produced_workflows)
-        deltaWorkflows = cw_length - last_consumed_workflows
+    if series_writer is not None or metrics_file is not None:
+        record = {
+            'timestamp': currentTime,
+            'posted': tracker.posted,
+            'finished': cw_length,
+            'dropped': tracker.dropped,
+            'in_flight': tracker.in_flight(),
+            'backlog': consumer.backlog,
+            'throughput': windowWorkflows / windowTime if windowTime > 0 else 0.0
+        }
+        for key in ['p50', 'p90', 'p99', 'p99.9']:
+            record[key] = window[key]
+        for name, depth in depths.iteritems():
+            record[DEPTH_PREFIX + name] = depth
+        if series_writer is not None:
+            series_writer.write(record)
+        if metrics_file is not None:
+            metrics_file.write(record, tracker.latency_summary())
 
-        if( deltaTime >= SAMPLING_WINDOW and deltaWorkflows > 0 ):
-            lastTime = currentTime
-            throughput =  deltaWorkflows / (deltaTime)
-            last_consumed_workflows = cw_length
-            agrigateThroughput = cw_length/ (currentTime - start_time)
+def build_result():
+    elapsed = time.time() - start_time
+    result = {
+        'posted': tracker.posted,
+        'finished': tracker.finished,
+        'dropped': tracker.dropped,
+        'lost': tracker.lost,
+        'lost_ids': lost_workflows,
+        'unmatched': tracker.unmatched,
+        'elapsed': elapsed,
+        'throughput': tracker.finished / elapsed if elapsed > 0 else 0.0,
+        'post_rate': poster.post_rate(),
+        'max_lag': poster.max_lag,
+        'latency': tracker.latency_summary(),
+        'graphs': tracker.graph_summaries(),
+        'endpoints': tracker.endpoint_summaries()
+    }
+    if WARMUP or COOLDOWN:
+        result['steady_state'] = steady_state_summary()
+    return result
 
+def check_baseline(result):
+    rows, failures = compare_results(result, load_result(BASELINE), MAX_THROUGHPUT_DROP, MAX_P99_RISE)
+    print '\nBaseline comparison ({0}):'.format(BASELINE)
+    print format_comparison(rows)
+    for failure in failures:
+        print 'REGRESSION: {0}'.format(failure)
+    return not failures
 
-        if(pw_length == TOTAL_WORKFLOWS and  cw_length == TOTAL_WORKFLOWS):
-            amqp_listner_worker.stop()
-            break
+# options the parent of a --trials run handles itself, and output paths each trial gets its own copy of
+TRIAL_DROP = ['--trials', '--trial_pause', '--result', '--baseline', '--footprint_case']
+TRIAL_PATHS = ['--series', '--record_trace', '--profile', '--store_path']
+
+def run_trials(args):
+    """
+    Run the configured workload args.trials times, each trial in a fresh
+    performance.py process that purges the graph.finished queue first, and
+    summarize throughput and latency across the trials
+    :return: the combined summary, None if no trial completed
+    """
+    markers = FootprintMarkers(path=args.footprint_case) if args.footprint_case else None
+    directory = tempfile.mkdtemp(prefix='performance-trials-')
+    results = []
+    try:
+        for index in range(1, args.trials + 1):
+            if index > 1 and args.trial_pause:
+                time.sleep(args.trial_pause)
+            path = os.path.join(directory, 'trial{0}.json'.format(index))
+            command = [sys.executable, os.path.abspath(__file__)] + \
+                      trial_arguments(sys.argv[1:], index, TRIAL_DROP, TRIAL_PATHS) + ['--result', path]
+            print '\nTrial {0}/{1}:'.format(index, args.trials)
+            sys.stdout.flush()
+            if markers is not None:
+                markers.mark('trial {0} start'.format(index))
+            code = subprocess.call(command)
+            if markers is not None:
+                markers.mark('trial {0} end'.format(index))
+            if code != 0 or not os.path.exists(path):
+                print 'Trial {0} failed with exit code {1}, left out of the summary'.format(index, code)
+                continue
+            results.append(load_result(path))
+    finally:
+        shutil.rmtree(directory, True)
+    if not results:
+        return None
+    stats = summarize_trials(results)
+    print '\nAcross {0} of {1} trials{2}:'.format(len(results), args.trials,
+                                                 ' (steady state)' if args.warmup or args.cooldown else '')
+    print format_trials(stats)
+    def mean(metric):
+        return stats[metric]['mean'] if stats[metric] is not None else None
+    # the means in the shape of a single run summary, so --baseline works across both kinds
+    return {
+        'trials': results,
+        'trial_stats': stats,
+        'throughput': mean('throughput'),
+        'post_rate': mean('post_rate'),
+        'dropped': sum(result['dropped'] for result in results) / float(len(results)),
+        'latency': dict((name, mean(name)) for name in ['p50', 'p90', 'p99', 'p99.9', 'mean'])
+    }
+
+def analyze_function(TOTAL_WORKFLOWS, SAMPLING_WINDOW, REFRESH_RATE):
+    global start_time, last_sample_time, last_finished, window_start, window_finished
+    start_time = time.time()
+    last_sample_time = window_start = start_time
+    last_finished = window_finished = tracker.finished
+    sampler.every(SAMPLING_WINDOW, sample_function)
+    if WORKFLOW_TIMEOUT:
+        sampler.every(1.0, expire_function)
+    sampler.every(1.0 / REFRESH_RATE, print_function)
+    sampler.start()
+    if DURATION is not None:
+        # the number of posts is only known once posting stops, re-check on the sampling window
+        tracker.wait_until(lambda: poster.posting_done() and tracker.in_flight() == 0, SAMPLING_WINDOW)
+        consumer.stop()
+    elif TOTAL_WORKFLOWS is not None:
+        tracker.wait_until(lambda: tracker.posted + tracker.dropped == TOTAL_WORKFLOWS and tracker.in_flight() == 0)
+        consumer.stop()
+
+def poller_print_function():
+    print ("\r Results:{0} Pollers:{1} Rate:{2:.2f}/s Unrecognized:{3}".format(
+        pollers.results, len(pollers.states), pollers.results / (time.time() - pollers.start_time),
+        pollers.unknown)),
+    sys.stdout.flush()
+
+def poller_function():
+    """
+    Consume copies of the IPMI poller result/alert queues for DURATION seconds
+    and report rate, interval, jitter and missed polls per node and command
+    """
+    global start_cpu
+    start_cpu = cpu_seconds()
+    worker = AMQPWorker(queue=make_poller_queues(), callbacks=[pollers.handle_result], **AMQP_OPTIONS)
+    worker_thread = Thread(target=worker.start, name='consumer-pollers')
+    worker_thread.daemon = True
+    worker_thread.start()
+    sampler.every(1.0 / REFRESH_RATE, poller_print_function)
+    sampler.start()
+    time.sleep(DURATION)
+    sampler.stop()
+    worker.stop()
+    worker_thread.join(1)
+    commands = pollers.command_summaries()
+    rows = pollers.poller_summaries()
+    print '\n' + format_poller_table(commands, rows, POLLER_TOP)
+    return {'commands': commands, 'pollers': rows}
 
 if __name__ == '__main__':
     if len(sys.argv) >= 0:
         parser = argparse.ArgumentParser(formatter_class=RawTextHelpFormatter, description=
         """A performance tool to calcualte the throughput of workflows/sec processed by RackHD. The output looks like the following:
-        PostedWFs:13 FinishedWFs:14 DroppedWFs:0 Tph:0.00wf/s avgTph:0.00wf/s max_wait=0.00sec
+        PostedWFs:13 FinishedWFs:14 DroppedWFs:0 Pps:6.50wf/s Tph:0.00wf/s avgTph:0.00wf/s max_wait=0.00sec p50=0.00sec p99=0.00sec winP99=0.00sec backlog=0
 
         PostedWFs: is the number of workflows that have been posted to RackHD
         FinishedWFs: Number of workflows that has been proccessed by RackHD
+        Pps: Achieved post rate, which is the number of workflows/sec posted to RackHD
         Tph: Troughput, which is the number of workflows/sec that are being proccessed by RackHD
         Tph: Troughput, which is the number of workflows/sec that are being proccessed by RackHD
         avgTph: Average or aggregate throughput
         max_wait: Number of Seconds that the longest workflow had to wait in the queue before it got proccessed
+        p50/p99: Cumulative median and 99th percentile workflow latency
+        winP99: 99th percentile workflow latency over the last sampling window
+        backlog: graph.finished messages waiting in the broker for the harness' consumer, not counting the
+                 up to --prefetch_count messages already delivered to it
         """)
         parser.add_argument('-RR','--refresh_rate', type=int, default=15, required=False,
                             help="The refresh rate of the screen(per sec), default value is 15")
         parser.add_argument('-TF','--total_workflows', type=int, default=20, required=False,
                             help="Total number of workflows that will be posted, default value is: 20")
+        parser.add_argument('-D','--duration', type=float, default=None, required=False,
+                            help="Post workflows for this many seconds instead of --total_workflows, default: count based")
+        parser.add_argument('--warmup', type=float, default=0.0, required=False,
+                            help="Seconds at the start of posting whose workflows run but are left out of the steady-state\n"
+                                 "statistics (JIT warm-up, cache filling), default value is: 0")
+        parser.add_argument('--cooldown', type=float, default=0.0, required=False,
+                            help="Seconds at the end of posting whose workflows run but are left out of the steady-state\n"
+                                 "statistics, default value is: 0")
         parser.add_argument('-H','--host', default='localhost:8080', required=False,
-                            help="RackHD IP:PORT, default is: localhost:8080 ")
+                            help="RackHD IP:PORT, or a comma separated list of them (e.g. the on-http instances of an HA\n"
+                                 "deployment) to spread the posts over, default is: localhost:8080 ")
+        parser.add_argument('--dispatch', default='round_robin', choices=DISPATCH, required=False,
+                            help="How posts are spread over several --host endpoints: in turn, or to the endpoint with the\n"
+                                 "fewest posts awaiting a response, default is: round_robin")
         parser.add_argument('-SW','--sampling_window', type=int, default=3.0, required=False,
                             help="The period over which it is used to calculate the throughput, default value: 3.0 sec")
+        parser.add_argument('-C','--concurrency', type=int, default=1, required=False,
+                            help="Number of workflows posted in parallel over a shared keep-alive connection pool, default value is: 1")
+        parser.add_argument('-R','--rate', type=float, default=None, required=False,
+                            help="Open-loop mode: post workflows at this rate (wf/s) on wall-clock deadlines, regardless of\n"
+                                 "how long responses take. Latency is measured from the scheduled send time. Default: closed-loop")
+        parser.add_argument('-A','--arrival', default='constant', choices=ARRIVALS, required=False,
+                            help="Inter-arrival distribution used with --rate, default is: constant")
+        parser.add_argument('-W','--workload', default=None, required=False,
+                            help="JSON (or YAML, with PyYAML) workload file listing graph names, POST bodies/options,\n"
+                                 "target node ids and relative weights. Default: Graph.noop-example only")
+        parser.add_argument('--replay', default=None, required=False,
+                            help="Replay the workflow arrivals of a trace recorded with --record_trace, or of a RackHD API\n"
+                                 "access log, keeping the original inter-arrival times. Overrides --total_workflows,\n"
+                                 "--rate and --workload")
+        parser.add_argument('--speed', type=float, default=1.0, required=False,
+                            help="Replay speed multiple, 2.0 replays twice as fast, default value is: 1.0")
+        parser.add_argument('--record_trace', default=None, required=False,
+                            help="Record the arrival time, graph, options and target node of every posted workflow to\n"
+                                 "this JSONL trace file, for a later --replay")
+        parser.add_argument('-FC','--find_capacity', action='store_true', required=False,
+                            help="Capacity finder: step the offered rate from --rate_start by --rate_step, holding each rate\n"
+                                 "for --step_window sec, until p99 latency exceeds --slo_p99 or the drop rate exceeds\n"
+                                 "--slo_drop_rate. Prints rate/throughput/p50/p95/p99/drops per step and the knee point")
+        parser.add_argument('--self_benchmark', action='store_true', required=False,
+                            help="Benchmark the harness itself: publish synthetic graph.finished events to the broker\n"
+                                 "instead of posting to RackHD, and step their rate like --find_capacity to find the\n"
+                                 "highest rate AMQPWorker + handle_graph_finish sustain, with their CPU cost per event.\n"
+                                 "Use --amqp_url memory:// for an in-process broker stand-in")
+        parser.add_argument('--pollers', action='store_true', required=False,
+                            help="IPMI poller benchmark: instead of posting workflows, consume the sel/sdr/chassis result\n"
+                                 "and sel alert events for --duration sec and report per command and per node the result\n"
+                                 "rate, actual vs. configured poll interval, interval jitter and missed polls. Configured\n"
+                                 "intervals are read from the RackHD pollers API")
+        parser.add_argument('--poll_interval', type=float, default=None, required=False,
+                            help="Configured poll interval (sec) for pollers the API does not list, default: unknown")
+        parser.add_argument('--poller_top', type=int, default=20, required=False,
+                            help="Number of pollers with the worst jitter listed, default value is: 20")
+        parser.add_argument('--amqp_url', default=AMQP_URL, required=False,
+                            help="AMQP broker URL, or a comma separated list of them to consume graph.finished from every\n"
+                                 "broker. Queue monitoring, --breakdown and --pollers use the first one,\n"
+                                 "default is: {0}".format(AMQP_URL))
+        parser.add_argument('--rate_start', type=float, default=1.0, required=False,
+                            help="First offered rate (wf/s) of the capacity finder, default value is: 1.0")
+        parser.add_argument('--rate_step', type=float, default=1.0, required=False,
+                            help="Rate increment (wf/s) between capacity finder steps, default value is: 1.0")
+        parser.add_argument('--rate_max', type=float, default=None, required=False,
+                            help="Highest rate (wf/s) the capacity finder will offer, default: unbounded")
+        parser.add_argument('--rate_resolution', type=float, default=0, required=False,
+                            help="Bisect between the last passing and first failing rate down to this resolution (wf/s),\n"
+                                 "default value is: 0 (no bisection)")
+        parser.add_argument('--step_window', type=float, default=30.0, required=False,
+                            help="Seconds each capacity finder rate is held, default value is: 30.0")
+        parser.add_argument('--drain_timeout', type=float, default=30.0, required=False,
+                            help="Seconds to wait for a step's workflows to finish before counting them as drops, default value is: 30.0")
+        parser.add_argument('--slo_p99', type=float, default=5.0, required=False,
+                            help="p99 completion latency SLO in seconds, default value is: 5.0")
+        parser.add_argument('--slo_drop_rate', type=float, default=0.01, required=False,
+                            help="Drop rate SLO as a fraction of posted workflows, default value is: 0.01")
+        parser.add_argument('-P','--processes', type=int, default=1, required=False,
+                            help="Number of worker processes, each with its own poster (--concurrency threads) and its own\n"
+                                 "consumer on the graph.finished queue. --total_workflows and --rate are split across them,\n"
+                                 "default value is: 1")
+        parser.add_argument('--prefetch_count', type=int, default=100, required=False,
+                            help="AMQP prefetch count (QoS) of the graph.finished consumer, 0 for unlimited. The backlog\n"
+                                 "only counts messages the broker has not delivered yet, so with an unlimited prefetch it\n"
+                                 "stays near 0 even when the harness falls behind, default value is: 100")
+        parser.add_argument('--ack_batch', type=int, default=1, required=False,
+                            help="Acknowledge graph.finished messages with one multi-ack every N messages, default value is: 1")
+        parser.add_argument('--ack_interval', type=float, default=0.25, required=False,
+                            help="Max seconds a message waits for its batched ack, default value is: 0.25")
+        parser.add_argument('--breakdown', action='store_true', required=False,
+                            help="Also consume graph.started and task events from on.events/on.task, correlate them by\n"
+                                 "graph id and report API-accept, scheduler wait and execution time, plus execution\n"
+                                 "time per task name")
+        parser.add_argument('--workflow_timeout', type=float, default=600.0, required=False,
+                            help="Seconds after its send time a workflow without graph.finished is reported as lost and no\n"
+                                 "longer waited for, 0 waits forever, default value is: 600.0")
+        parser.add_argument('--cancel_lost', action='store_true', required=False,
+                            help="Cancel lost workflows through the RackHD API")
+        parser.add_argument('--store_path', default=None, required=False,
+                            help="Memory-map the per-workflow record store to <store_path>.<column> files (requires NumPy),\n"
+                                 "default: in memory")
+        parser.add_argument('--series', default=None, required=False,
+                            help="Append one record per sampling window (timestamp, posted, finished, dropped, in-flight,\n"
+                                 "window throughput and latency percentiles) to this file, JSONL if it ends with .jsonl,\n"
+                                 "CSV otherwise")
+        parser.add_argument('--watch_queues', type=lambda names: [name for name in names.split(',') if name],
+                            default=[], required=False,
+                            help="Comma separated broker queues (e.g. RackHD's on.events/on.task consumer queues) whose\n"
+                                 "depth is sampled with passive declares every window, next to graph.finished, and written\n"
+                                 "to --series/--metrics_file as depth.<queue>")
+        parser.add_argument('--metrics_file', default=None, required=False,
+                            help="Atomically rewrite this Prometheus text format file every sampling window")
+        parser.add_argument('--footprint_case', default=None, required=False,
+                            help="footprint-benchmark case directory (see its benchmark.py --getdir) to write load phase\n"
+                                 "markers into: run start, warm-up end, cool-down start, each capacity finder rate and\n"
+                                 "run end, shown on the footprint report's graphs")
+        parser.add_argument('--profile', default=None, required=False,
+                            help="Profile the harness' poster, consumer and analyzer threads and write one file per thread\n"
+                                 "role to this directory at exit (worker processes of --processes to worker<N>/ below it)")
+        parser.add_argument('--profiler', default='sampling', choices=PROFILERS, required=False,
+                            help="sampling: sample all thread stacks every --profile_interval and write <role>.collapsed\n"
+                                 "stacks (flamegraph.pl, speedscope), wall-clock time including I/O waits, low overhead;\n"
+                                 "cprofile: run cProfile in every thread and write <role>.pstats (python -m pstats,\n"
+                                 "snakeviz), CPU-exact per function but slows the harness. Default is: sampling")
+        parser.add_argument('--profile_interval', type=float, default=0.01, required=False,
+                            help="Seconds between stack samples of the sampling profiler, default value is: 0.01")
+        parser.add_argument('--trials', type=int, default=1, required=False,
+                            help="Run the configured workload this many times, each in a fresh process that purges the\n"
+                                 "graph.finished queue first, and report the mean and median throughput and latency with\n"
+                                 "95%% confidence intervals and the coefficient of variation. With --baseline from another\n"
+                                 "--trials run, only significant regressions fail. Default value is: 1")
+        parser.add_argument('--trial_pause', type=float, default=0.0, required=False,
+                            help="Seconds to let RackHD settle between trials, default value is: 0")
+        parser.add_argument('--result', default=None, required=False,
+                            help="Write the final summary as JSON to this file, for use as a later --baseline")
+        parser.add_argument('--baseline', default=None, required=False,
+                            help="Compare the final summary against this stored --result file and exit non-zero when\n"
+                                 "throughput or p99 latency regress past the tolerances")
+        parser.add_argument('--max_throughput_drop', type=float, default=0.05, required=False,
+                            help="Allowed relative throughput drop against --baseline, default value is: 0.05")
+        parser.add_argument('--max_p99_rise', type=float, default=0.10, required=False,
+                            help="Allowed relative p99 latency rise against --baseline, default value is: 0.10")
         args = parser.parse_args()
+        if args.processes > 1 and args.find_capacity:
+            parser.error('--find_capacity runs in a single process, drop --processes')
+        if args.processes > 1 and args.breakdown:
+            parser.error('--breakdown runs in a single process, drop --processes')
+        if args.processes > 1 and (args.replay or args.record_trace):
+            parser.error('--replay and --record_trace run in a single process, drop --processes')
+        if args.replay and (args.find_capacity or args.duration):
+            parser.error('--replay posts the whole trace, drop --find_capacity/--duration')
+        if args.self_benchmark and (args.processes > 1 or args.breakdown or args.replay or args.record_trace):
+            parser.error('--self_benchmark runs in a single process without --breakdown/--replay/--record_trace')
+        if args.pollers and args.duration is None:
+            parser.error('--pollers needs --duration')
+        if args.pollers and (args.processes > 1 or args.find_capacity or args.self_benchmark or args.replay):
+            parser.error('--pollers runs in a single process without --find_capacity/--self_benchmark/--replay')
+        if args.speed <= 0:
+            parser.error('--speed must be positive')
+        if args.trials < 1:
+            parser.error('--trials must be at least 1')
+        if args.trials > 1 and (args.pollers or args.find_capacity or args.self_benchmark):
+            parser.error('--trials repeats workflow runs, drop --pollers/--find_capacity/--self_benchmark')
+        if args.find_capacity and (args.duration or args.warmup or args.cooldown):
+            parser.error('--find_capacity holds each rate for --step_window, drop --duration/--warmup/--cooldown')
+        if args.duration is not None and args.warmup + args.cooldown >= args.duration:
+            parser.error('--warmup + --cooldown must be shorter than --duration')
+
+        BASELINE = args.baseline
+        MAX_THROUGHPUT_DROP = args.max_throughput_drop
+        MAX_P99_RISE = args.max_p99_rise
+        if args.trials > 1:
+            result = run_trials(args)
+            if result is None:
+                print 'No trial completed'
+                sys.exit(1)
+            if args.result:
+                save_result(args.result, result)
+            if BASELINE and not check_baseline(result):
+                sys.exit(1)
+            sys.exit(0)
 
         REFRESH_RATE = args.refresh_rate
-        TOTAL_WORKFLOWS = args.total_workflows
-        HOST = args.host
+        DURATION = args.duration
+        TOTAL_WORKFLOWS = None if DURATION is not None else args.total_workflows
+        REPLAY = load_trace(args.replay) if args.replay else None
+        SPEED = args.speed
+        if REPLAY is not None:
+            TOTAL_WORKFLOWS = len(REPLAY)
+        if args.record_trace:
+            trace_recorder = TraceRecorder(args.record_trace)
+        WARMUP = args.warmup
+        COOLDOWN = args.cooldown
+        HOSTS = [host for host in args.host.split(',') if host]
+        DISPATCH_POLICY = args.dispatch
         SAMPLING_WINDOW = args.sampling_window
+        CONCURRENCY = args.concurrency
+        RATE = args.rate
+        ARRIVAL = args.arrival
+        WORKLOAD = Workload.load(args.workload) if args.workload else Workload.default()
+        SELF_BENCHMARK = args.self_benchmark
+        POLLER_TOP = args.poller_top
+        FIND_CAPACITY = args.find_capacity or SELF_BENCHMARK
+        AMQP_URLS = [url for url in args.amqp_url.split(',') if url]
+        AMQP_URL = AMQP_URLS[0]
+        RATE_START = args.rate_start
+        RATE_STEP = args.rate_step
+        RATE_MAX = args.rate_max
+        RATE_RESOLUTION = args.rate_resolution
+        STEP_WINDOW = args.step_window
+        DRAIN_TIMEOUT = args.drain_timeout
+        SLO_P99 = args.slo_p99
+        SLO_DROP_RATE = args.slo_drop_rate
+        PROCESSES = args.processes
+        WORKFLOW_TIMEOUT = args.workflow_timeout
+        CANCEL_LOST = args.cancel_lost
+        tracker = WorkflowTracker(store=RecordStore(path=args.store_path), timeout=WORKFLOW_TIMEOUT or None)
+        if args.series or args.metrics_file or args.watch_queues:
+            queue_monitor = QueueMonitor(queues=[QUEUE_GRAPH_FINISH.name] + args.watch_queues, amqp_url=AMQP_URL)
+        if args.series:
+            series_writer = SeriesWriter(args.series, SERIES_FIELDS +
+                                         [DEPTH_PREFIX + name for name in queue_monitor.queues()])
+        if args.metrics_file:
+            metrics_file = MetricsFile(args.metrics_file)
+        if args.footprint_case:
+            footprint = FootprintMarkers(path=args.footprint_case)
+        PROFILE_OPTIONS = None
+        if args.profile:
+            PROFILE_OPTIONS = {'path': args.profile, 'mode': args.profiler, 'interval': args.profile_interval}
+            profiler = ThreadProfiler(**PROFILE_OPTIONS)
+        if args.breakdown:
+            lifecycle = LifecycleTracker()
+            tracker.add_listener(lifecycle.complete)
 
-    amqp_listner_worker = AMQPWorker(queue=QUEUE_GRAPH_FINISH, callbacks=[handle_graph_finish])
-    BASE_URL = 'http://{0}/api/1.1'.format(HOST)
-
-    def post(path, data=None, headers=None):
-        return requests.post(BASE_URL + path, data, headers=headers)
-
-    def thread_func(worker, id):
-        worker.start()
+    AMQP_OPTIONS = {
+        'amqp_url': AMQP_URL,
+        # only used by polling transports such as memory://, their default is 1 sec
+        'transport_options': {'polling_interval': 0.01},
+        'prefetch_count': args.prefetch_count,
+        'ack_batch': args.ack_batch,
+        'ack_interval': args.ack_interval
+    }
+    amqp_listner_worker = ConsumerGroup(amqp_urls=AMQP_URLS, queue=QUEUE_GRAPH_FINISH, callbacks=[handle_graph_finish],
+                                        **AMQP_OPTIONS)
+    BASE_URLS = ['http://{0}/api/1.1'.format(host) for host in HOSTS]
+    BASE_URL = BASE_URLS[0]
+    consumer = amqp_listner_worker
+    if lifecycle is not None:
+        lifecycle_listener = AMQPWorker(queue=make_lifecycle_queues(), callbacks=[lifecycle.handle_event], **AMQP_OPTIONS)
+        lifecycle_worker = Thread(target=lifecycle_listener.start, name='consumer-lifecycle')
+        lifecycle_worker.daemon = True
+    poster = WorkflowPoster(endpoints=EndpointPool(urls=BASE_URLS, dispatch=DISPATCH_POLICY), tracker=tracker,
+                            concurrency=CONCURRENCY, workload=WORKLOAD, trace=trace_recorder)
+    workflow_api = poster
+    if SELF_BENCHMARK:
+        poster = SyntheticPublisher(tracker=tracker, amqp_url=AMQP_URL)
+    if PROCESSES > 1:
+        # worker processes post and consume, this process merges their deltas
+        consumer = poster = Coordinator(processes=PROCESSES, tracker=tracker, options={
+            'base_urls': BASE_URLS, 'dispatch': DISPATCH_POLICY, 'concurrency': CONCURRENCY, 'total': TOTAL_WORKFLOWS, 'duration': DURATION,
+            'rate': RATE, 'arrival': ARRIVAL, 'workload': args.workload, 'amqp_urls': AMQP_URLS, 'amqp': AMQP_OPTIONS,
+            'profile': PROFILE_OPTIONS
+        })
 
     def run():
-        post_worker = Thread(target=post_function,args=(TOTAL_WORKFLOWS,))
-        analyzer_worker = Thread(target=analyze_function, args=(TOTAL_WORKFLOWS,SAMPLING_WINDOW))
-        printing_worker = Thread(target=print_function, args=[REFRESH_RATE])
-        printing_worker.daemon = True
+        global start_cpu
+        start_cpu = cpu_seconds()
+        if footprint is not None:
+            footprint.mark('run start')
+            if WARMUP:
+                footprint.mark_after(WARMUP, 'warm-up end')
+            if DURATION is not None and COOLDOWN:
+                footprint.mark_after(DURATION - COOLDOWN, 'cool-down start')
+        if FIND_CAPACITY:
+            post_worker = Thread(target=capacity_function, name='poster-main')
+            analyzer_worker = Thread(target=analyze_function, args=(None,SAMPLING_WINDOW,REFRESH_RATE), name='analyzer')
+        else:
+            post_worker = Thread(target=post_function,args=(TOTAL_WORKFLOWS,), name='poster-main')
+            analyzer_worker = Thread(target=analyze_function, args=(TOTAL_WORKFLOWS,SAMPLING_WINDOW,REFRESH_RATE),
+                                     name='analyzer')
         analyzer_worker.daemon = True
         post_worker.daemon = True
-        printing_worker.start()
+        if lifecycle is not None:
+            lifecycle_worker.start()
         analyzer_worker.start()
-        post_worker.start()
-        amqp_listner_worker.start()
+        if PROCESSES > 1:
+            consumer.start()
+            consumer.run()
+        else:
+            post_worker.start()
+            if profiler is not None:
+                # the graph.finished consumer runs on the main thread
+                profiler.call('consumer', amqp_listner_worker.start)
+            else:
+                amqp_listner_worker.start()
 
     def clear_queue():
-        task = WorkerThread(amqp_listner_worker, 'amqp')
-        tasks = WorkerTasks(tasks=[task], func=thread_func)
-        print'Clearing the graph.finished queue...'
-        tasks.run()
-        tasks.wait_for_completion(time_to_clear_queue)
+        print 'Purging the graph.finished queue...'
+        purged = sum(purge_queue(QUEUE_GRAPH_FINISH, url) for url in AMQP_URLS)
+        if purged:
+            print '{0} stale graph.finished messages purged'.format(purged)
+
+    def write_profile():
+        profiler.stop()
+        files = profiler.write()
+        print 'Profile ({0}{1}) written to: {2}'.format(
+            args.profiler, ', {0} samples'.format(profiler.samples) if args.profiler == 'sampling' else '',
+            ' '.join(files) or 'no threads profiled')
+
+    if profiler is not None:
+        profiler.start()
+
+    if args.pollers:
+        try:
+            configured = fetch_poller_intervals(BASE_URL)
+        except (RequestException, ValueError) as e:
+            print 'Could not read the configured poller intervals from RackHD: {0}'.format(e)
+            configured = {}
+        pollers = PollerTracker(pollers=configured, interval=args.poll_interval)
+        if footprint is not None:
+            footprint.mark('pollers start')
+        result = poller_function()
+        if footprint is not None:
+            footprint.mark('pollers end')
+        if profiler is not None:
+            write_profile()
+        if args.result:
+            save_result(args.result, result)
+        sys.exit(0)
 
     clear_queue()
     run()
+    if footprint is not None:
+        footprint.cancel()
+        footprint.mark('run end')
+    sampler.stop()
+    # the last, partial window
+    sample_function()
+    if CANCEL_LOST:
+        workflow_api.stop_cancels(10)
+    if lifecycle is not None:
+        lifecycle_listener.stop()
+    if series_writer is not None:
+        series_writer.close()
+    if queue_monitor is not None:
+        queue_monitor.close()
+    if trace_recorder is not None:
+        trace_recorder.close()
+    tracker.store.flush()
+    tracker.purge_early()
+    print_summary()
+    if profiler is not None:
+        write_profile()
+    result = build_result()
+    if args.result:
+        save_result(args.result, result)
+    if BASELINE and not check_baseline(result):
+        sys.exit(1)
     sys.exit(0)
 
 